@@ -0,0 +1,373 @@
+import csv
+import logging
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import numpy as np
+import orjson
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import pandas as pd
+import time
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional
+
+from rate_limiter import TokenBucket
+
+# Candles requested per page. /fapi/v1/klines returns up to 1500, but any limit
+# over 1000 costs weight 10 instead of 5, so 1000-candle pages fetch 200 candles
+# per weight unit against 150 for 1500-candle pages
+MAX_KLINES_PER_REQUEST = 1000
+# Binance futures allows 2400 request weight per minute per IP
+WEIGHT_LIMIT_PER_MINUTE = 2400
+# Back off once the server reports this much weight used in the current minute
+WEIGHT_BACKOFF_THRESHOLD = 2000
+
+logger = logging.getLogger(__name__)
+
+
+# Fields kept from each raw kline row
+KLINE_DTYPE = np.dtype([
+    ('open_time', 'i8'), ('open', 'f8'), ('high', 'f8'),
+    ('low', 'f8'), ('close', 'f8'), ('volume', 'f8')
+])
+
+# Column layout of the Parquet output
+KLINE_SCHEMA = pa.schema([
+    ('Timestamp', pa.int64()),
+    ('Open', pa.float64()),
+    ('High', pa.float64()),
+    ('Low', pa.float64()),
+    ('Close', pa.float64()),
+    ('Volume', pa.float64()),
+    ('Datetime', pa.timestamp('ms'))
+])
+
+
+def kline_request_weight(limit: int) -> int:
+    """Request weight of /fapi/v1/klines for the given limit"""
+    if limit < 100:
+        return 1
+    if limit < 500:
+        return 2
+    if limit <= 1000:
+        return 5
+    return 10
+
+
+def flatten_chunks(chunks: List[Optional[List]]) -> List:
+    """Concatenate per-request chunks into one list allocated at its final size"""
+    all_data = [None] * sum(len(chunk) for chunk in chunks if chunk)
+    position = 0
+    for chunk in chunks:
+        if chunk:
+            all_data[position:position + len(chunk)] = chunk
+            position += len(chunk)
+    return all_data
+
+
+def format_utc_minute(timestamp_ms: int) -> str:
+    """Format a millisecond timestamp as 'YYYY-MM-DD HH:MM' (UTC) for progress logs"""
+    t = time.gmtime(timestamp_ms // 1000)
+    return f"{t.tm_year:04d}-{t.tm_mon:02d}-{t.tm_mday:02d} {t.tm_hour:02d}:{t.tm_min:02d}"
+
+
+def format_utc(timestamp: int, fmt: str = '%Y-%m-%d %H:%M:%S') -> str:
+    """Format a Unix timestamp (seconds) as a naive UTC datetime string"""
+    return time.strftime(fmt, time.gmtime(timestamp))
+
+
+class BinanceKlineClient:
+    """
+    Shared plumbing for the Binance futures kline scripts: a pooled, rate-limited
+    HTTP session, windowed concurrent fetching and Parquet/CSV output
+    """
+    
+    def __init__(self, base_url: str = "https://fapi.binance.com"):
+        self.base_url = base_url
+        self.session = requests.Session()
+        self.size_pool(32)
+        self.session.headers.update({
+            "Accept-Encoding": "gzip, deflate",
+            "User-Agent": "cex-historical/1.0"
+        })
+        
+        # Weight budget shared by every worker thread using this instance
+        self.rate_limiter = TokenBucket(capacity=WEIGHT_LIMIT_PER_MINUTE,
+                                        refill_per_sec=WEIGHT_LIMIT_PER_MINUTE / 60)
+        
+        # Set to make every download running on this instance stop at its next
+        # request (worker threads never see KeyboardInterrupt themselves)
+        self.stop_event = threading.Event()
+    
+    def size_pool(self, max_connections: int) -> None:
+        """
+        Size the keep-alive pool for concurrent workers and retry transient errors
+        
+        Args:
+            max_connections: Largest number of requests in flight at once; a
+                smaller pool makes urllib3 discard and reopen connections
+        """
+        adapter = HTTPAdapter(
+            pool_connections=32,
+            pool_maxsize=max_connections,
+            max_retries=Retry(
+                total=5,
+                backoff_factor=0.5,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=frozenset(["GET"]),
+                respect_retry_after_header=True
+            )
+        )
+        self.session.mount("https://", adapter)
+    
+    def fetch_klines(self, symbol: str, interval: str, start_time: int,
+                    end_time: int, limit: int = MAX_KLINES_PER_REQUEST) -> Optional[List]:
+        """
+        Fetch kline data from Binance API
+        
+        Args:
+            symbol: Trading pair (e.g., 'BTCUSDT')
+            interval: Time interval (e.g., '1m', '5m', '1h', '1d')
+            start_time: Start time in milliseconds
+            end_time: End time in milliseconds
+            limit: Maximum number of records per request (max 1500)
+        
+        Returns:
+            List of kline data or None if error
+        """
+        endpoint = "/fapi/v1/klines"
+        params = {
+            'symbol': symbol,
+            'interval': interval,
+            'startTime': start_time,
+            'endTime': end_time,
+            'limit': limit
+        }
+        
+        if self.stop_event.is_set():
+            return None
+        
+        self.rate_limiter.acquire(kline_request_weight(limit))
+        
+        try:
+            response = self.session.get(f"{self.base_url}{endpoint}", params=params,
+                                        timeout=(3.05, 30))
+            response.raise_for_status()
+            
+            # Slow down proactively when the server says we are close to the cap
+            used_weight = int(response.headers.get('X-MBX-USED-WEIGHT-1M', 0))
+            if used_weight > WEIGHT_BACKOFF_THRESHOLD:
+                self.rate_limiter.limit_to(WEIGHT_LIMIT_PER_MINUTE - used_weight)
+            
+            return orjson.loads(response.content)
+        except requests.exceptions.RequestException as e:
+            logger.error("Error fetching data: %s", e)
+            return None
+        except orjson.JSONDecodeError as e:
+            logger.error("Error decoding response: %s", e)
+            return None
+    
+    def _iter_chunks(self, symbol: str, interval: str, start_time_ms: int, end_time_ms: int,
+                     stride_ms: int, concurrency: int, label: str) -> Iterator[List]:
+        """
+        Fetch a period window by window, yielding each non-empty chunk in
+        chronological order as soon as it is available
+        
+        Args:
+            symbol: Trading pair
+            interval: Time interval (e.g., '1m', '5m')
+            start_time_ms: Start time in milliseconds
+            end_time_ms: End time in milliseconds
+            stride_ms: Time covered by one full page of candles
+            concurrency: Maximum number of requests in flight at once
+            label: Prefix for progress messages
+        
+        Yields:
+            Lists of kline data, one per request window
+        
+        Raises:
+            RuntimeError: A window could not be fetched, or stop_event was set.
+                Nothing after it is yielded, so the chunks received so far form
+                a gap-free prefix
+        """
+        # Each request covers exactly one full page of candles, so the windows are
+        # known up front and independent of each other (end_time is inclusive)
+        starts = np.arange(start_time_ms, end_time_ms + 1, stride_ms, dtype=np.int64)
+        ends = np.minimum(starts + stride_ms - 1, end_time_ms)
+        windows = list(zip(starts.tolist(), ends.tolist()))
+        requests_needed = len(windows)
+        
+        # Report overall progress roughly every 10% instead of once per request
+        progress_every = max(1, requests_needed // 10)
+        record_count = 0
+        
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            # map() yields results in submission order, so chunks stay chronological
+            results = executor.map(
+                lambda window: self.fetch_klines(symbol, interval, window[0], window[1],
+                                                 MAX_KLINES_PER_REQUEST),
+                windows
+            )
+            
+            try:
+                for request_count, ((chunk_start, chunk_end), chunk_data) in enumerate(zip(windows, results), 1):
+                    if self.stop_event.is_set():
+                        raise RuntimeError(f"{label}: stopped before request "
+                                           f"{request_count}/{requests_needed}")
+                    
+                    if chunk_data is None:
+                        # Stop at the first failed window rather than skipping it, so
+                        # callers never end up with a silent gap in the middle
+                        raise RuntimeError(f"{label} request {request_count}/{requests_needed}: "
+                                           f"failed to fetch {format_utc_minute(chunk_start)} to "
+                                           f"{format_utc_minute(chunk_end)}")
+                    
+                    if chunk_data:
+                        record_count += len(chunk_data)
+                        logger.debug("%s request %d/%d: %s to %s: fetched %d records", label,
+                                     request_count, requests_needed, format_utc_minute(chunk_start),
+                                     format_utc_minute(chunk_end), len(chunk_data))
+                        yield chunk_data
+                    
+                    if request_count % progress_every == 0 or request_count == requests_needed:
+                        logger.info("%s progress: %d/%d requests, %s records", label, request_count,
+                                    requests_needed, f"{record_count:,}")
+            finally:
+                # However the loop ends, drop the requests that have not started
+                # instead of waiting for all of them on the way out
+                executor.shutdown(wait=False, cancel_futures=True)
+    
+    def _build_klines(self, data: List) -> np.ndarray:
+        """
+        Parse raw kline rows into a sorted, deduplicated structured array
+        
+        Args:
+            data: List of kline data
+        
+        Returns:
+            Structured array with open_time, open, high, low, close and volume fields
+        """
+        # View the rows as a 2-D object array, then convert the kept columns in
+        # bulk: open time is already an int, and the decimal price/volume strings
+        # go through one Arrow string -> float64 cast instead of a float() per value
+        rows = np.array(data, dtype=object)
+        prices = pc.cast(pa.array(rows[:, 1:6].ravel(), type=pa.string()), pa.float64())
+        prices = prices.to_numpy().reshape(-1, 5)
+        
+        klines = np.empty(len(rows), dtype=KLINE_DTYPE)
+        klines['open_time'] = rows[:, 0].astype(np.int64)
+        for column, field in enumerate(('open', 'high', 'low', 'close', 'volume')):
+            klines[field] = prices[:, column]
+        
+        # Sort by open time and keep the first row of each timestamp in one
+        # linear pass (duplicates can only appear at chunk boundaries)
+        order = np.argsort(klines['open_time'], kind='stable')
+        sorted_times = klines['open_time'][order]
+        keep = np.empty(sorted_times.size, dtype=bool)
+        keep[0] = True
+        keep[1:] = sorted_times[1:] != sorted_times[:-1]
+        klines = klines[order[keep]]
+        
+        duplicate_count = len(keep) - len(klines)
+        if duplicate_count:
+            logger.info("Removed %d duplicate records", duplicate_count)
+        
+        return klines
+    
+    def _klines_to_table(self, klines: np.ndarray) -> pa.Table:
+        """
+        Convert a structured kline array into an Arrow table in the output layout
+        
+        Args:
+            klines: Structured array from _build_klines
+        
+        Returns:
+            Table matching KLINE_SCHEMA
+        """
+        open_times = np.ascontiguousarray(klines['open_time'])
+        
+        return pa.table({
+            'Timestamp': open_times // 1000,  # Convert to seconds
+            'Open': np.ascontiguousarray(klines['open']),
+            'High': np.ascontiguousarray(klines['high']),
+            'Low': np.ascontiguousarray(klines['low']),
+            'Close': np.ascontiguousarray(klines['close']),
+            'Volume': np.ascontiguousarray(klines['volume']),
+            'Datetime': pa.array(open_times, type=pa.timestamp('ms'))
+        }, schema=KLINE_SCHEMA)
+    
+    def save_to_parquet(self, data: List, filename: str, label: str) -> None:
+        """
+        Convert kline data to a typed table and save as zstd-compressed Parquet
+        
+        Args:
+            data: List of kline data
+            filename: Output filename
+            label: Symbol or timeframe the data belongs to, for messages
+        """
+        if not data:
+            logger.warning("❌ No data to save for %s", label)
+            return
+        
+        table = self._klines_to_table(self._build_klines(data))
+        # Same temporary-file-then-rename scheme as save_to_csv
+        tmp_path = f"{filename}.tmp"
+        pq.write_table(table, tmp_path, compression='zstd', use_dictionary=False)
+        os.replace(tmp_path, filename)
+        
+        timestamps = table.column('Timestamp')
+        logger.info("💾 Saved to '%s' (%s records)", filename, f"{table.num_rows:,}")
+        logger.info("📅 Date range: %s to %s", format_utc(timestamps[0].as_py()),
+                    format_utc(timestamps[-1].as_py()))
+    
+    def save_to_csv(self, data: List, filename: str, label: str,
+                    include_datetime: bool = False) -> None:
+        """
+        Convert kline data to rows and stream them to a CSV file
+        
+        Args:
+            data: List of kline data
+            filename: Output filename
+            label: Symbol or timeframe the data belongs to, for messages
+            include_datetime: Also write the Datetime column. It is redundant with
+                Timestamp; readers can rebuild it with
+                pd.to_datetime(df['Timestamp'], unit='s')
+        """
+        if not data:
+            logger.warning("❌ No data to save for %s", label)
+            return
+        
+        klines = self._build_klines(data)
+        open_times = klines['open_time']
+        timestamps = open_times // 1000  # Convert to seconds
+        
+        header = ['Timestamp', 'Open', 'High', 'Low', 'Close', 'Volume']
+        columns = [timestamps.tolist(), klines['open'].tolist(), klines['high'].tolist(),
+                   klines['low'].tolist(), klines['close'].tolist(), klines['volume'].tolist()]
+        
+        if include_datetime:
+            # Match pandas, which drops the time part when every row is at midnight
+            datetime_format = '%Y-%m-%d %H:%M:%S' if (timestamps % 86400).any() else '%Y-%m-%d'
+            # Format the whole column in one vectorized call rather than per row
+            header.append('Datetime')
+            columns.append(pd.to_datetime(open_times, unit='ms', cache=True)
+                           .strftime(datetime_format).tolist())
+        
+        # Stream rows straight to disk instead of materializing a DataFrame. Write
+        # to a temporary file and rename it into place so an interrupted run never
+        # leaves a truncated CSV behind under the final name
+        tmp_path = f"{filename}.tmp"
+        with open(tmp_path, 'w', newline='', buffering=1 << 20) as f:
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerow(header)
+            writer.writerows(zip(*columns))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, filename)
+        
+        logger.info("💾 Saved to '%s' (%s records)", filename, f"{len(timestamps):,}")
+        logger.info("📅 Date range: %s to %s", format_utc(timestamps[0]), format_utc(timestamps[-1]))
@@ -1,60 +1,49 @@
-import requests
+import glob
+import logging
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 import pandas as pd
-import time
-import math
 import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
-from typing import List, Optional, Dict
+from typing import Dict, Iterator, List, Optional
 
-class MultiTimeframeBinanceDownloader:
+from binance_client import BinanceKlineClient, KLINE_SCHEMA, MAX_KLINES_PER_REQUEST, flatten_chunks
+
+logger = logging.getLogger(__name__)
+
+# Chunks written to a Parquet checkpoint before it is closed and renamed, which
+# bounds what a killed run loses (50,000 candles at 1000 per request)
+CHECKPOINT_CHUNKS = 50
+
+
+# A kline interval together with the span of time one full request covers
+Timeframe = namedtuple('Timeframe', 'key interval minutes_per_candle stride_ms')
+
+TIMEFRAMES = tuple(
+    Timeframe(key, interval, minutes, MAX_KLINES_PER_REQUEST * minutes * 60 * 1000)
+    for key, interval, minutes in (
+        ('1min', '1m', 1),
+        ('5min', '5m', 5),
+        ('15min', '15m', 15),
+        ('30min', '30m', 30),
+        ('1h', '1h', 60),
+        ('4h', '4h', 240),
+        ('6h', '6h', 360),
+        ('12h', '12h', 720),
+        ('1d', '1d', 1440)
+    )
+)
+
+
+class MultiTimeframeBinanceDownloader(BinanceKlineClient):
     def __init__(self, base_url: str = "https://fapi.binance.com"):
-        self.base_url = base_url
-        self.session = requests.Session()
-        
-        # Define timeframes with their interval codes and time per candle in minutes
-        self.timeframes = {
-            '1min': {'interval': '1m', 'minutes_per_candle': 1},
-            '5min': {'interval': '5m', 'minutes_per_candle': 5},
-            '15min': {'interval': '15m', 'minutes_per_candle': 15},
-            '30min': {'interval': '30m', 'minutes_per_candle': 30},
-            '1h': {'interval': '1h', 'minutes_per_candle': 60},
-            '4h': {'interval': '4h', 'minutes_per_candle': 240},
-            '6h': {'interval': '6h', 'minutes_per_candle': 360},
-            '12h': {'interval': '12h', 'minutes_per_candle': 720},
-            '1d': {'interval': '1d', 'minutes_per_candle': 1440}
-        }
-    
-    def fetch_klines(self, symbol: str, interval: str, start_time: int, 
-                    end_time: int, limit: int = 1000) -> Optional[List]:
-        """
-        Fetch kline data from Binance API
+        super().__init__(base_url)
         
-        Args:
-            symbol: Trading pair (e.g., 'BTCUSDT')
-            interval: Time interval (e.g., '1m', '5m', '1h', '1d')
-            start_time: Start time in milliseconds
-            end_time: End time in milliseconds
-            limit: Maximum number of records per request (max 1500)
-        
-        Returns:
-            List of kline data or None if error
-        """
-        endpoint = "/fapi/v1/klines"
-        params = {
-            'symbol': symbol,
-            'interval': interval,
-            'startTime': start_time,
-            'endTime': end_time,
-            'limit': limit
-        }
-        
-        try:
-            response = self.session.get(f"{self.base_url}{endpoint}", params=params)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            print(f"Error fetching data: {e}")
-            return None
+        # Timeframes in download order, keyed by name (e.g. '1min', '5min')
+        self.timeframes: Dict[str, Timeframe] = {tf.key: tf for tf in TIMEFRAMES}
     
     def calculate_requests_needed(self, timeframe: str, start_time: int, end_time: int) -> int:
         """
@@ -68,14 +57,45 @@ class MultiTimeframeBinanceDownloader:
         Returns:
             Number of requests needed
         """
-        total_minutes = (end_time - start_time) / 60
-        minutes_per_candle = self.timeframes[timeframe]['minutes_per_candle']
-        total_candles = total_minutes / minutes_per_candle
-        requests_needed = math.ceil(total_candles / 1000)
+        # One request per full page of candles; end_time is inclusive, which
+        # matches the windows built in _iter_timeframe_chunks
+        stride_ms = self.timeframes[timeframe].stride_ms
+        requests_needed = (end_time - start_time) * 1000 // stride_ms + 1
         return max(1, requests_needed)  # At least 1 request
     
+    def _iter_timeframe_chunks(self, symbol: str, timeframe: str, start_time: int,
+                               end_time: int, concurrency: int = 10) -> Iterator[List]:
+        """
+        Fetch a timeframe window by window, yielding each non-empty chunk in
+        chronological order as soon as it is available
+        
+        Args:
+            symbol: Trading pair
+            timeframe: Timeframe key (e.g., '1min', '5min')
+            start_time: Start time in Unix timestamp (seconds)
+            end_time: End time in Unix timestamp (seconds)
+            concurrency: Maximum number of requests in flight at once
+        
+        Yields:
+            Lists of kline data, one per request window
+        """
+        tf = self.timeframes[timeframe]
+        requests_needed = self.calculate_requests_needed(timeframe, start_time, end_time)
+        
+        logger.info("📊 Fetching %s data for %s: %s to %s, %d requests (%d concurrent)",
+                    timeframe, symbol, datetime.fromtimestamp(start_time),
+                    datetime.fromtimestamp(end_time), requests_needed, concurrency)
+        
+        record_count = 0
+        for chunk_data in self._iter_chunks(symbol, tf.interval, start_time * 1000, end_time * 1000,
+                                            tf.stride_ms, concurrency, timeframe):
+            record_count += len(chunk_data)
+            yield chunk_data
+        
+        logger.info("✅ %s: %s records fetched", timeframe, f"{record_count:,}")
+    
     def fetch_timeframe_data(self, symbol: str, timeframe: str, start_time: int, 
-                           end_time: int, delay: float = 0.1) -> List:
+                           end_time: int, concurrency: int = 10) -> List:
         """
         Fetch all data for a specific timeframe
         
@@ -84,120 +104,192 @@ class MultiTimeframeBinanceDownloader:
             timeframe: Timeframe key (e.g., '1min', '5min')
             start_time: Start time in Unix timestamp (seconds)
             end_time: End time in Unix timestamp (seconds)
-            delay: Delay between requests in seconds
+            concurrency: Maximum number of requests in flight at once
         
         Returns:
             List of all kline data for the timeframe
         """
-        # Convert to milliseconds
-        start_time_ms = start_time * 1000
-        end_time_ms = end_time * 1000
-        
-        interval = self.timeframes[timeframe]['interval']
-        minutes_per_candle = self.timeframes[timeframe]['minutes_per_candle']
-        requests_needed = self.calculate_requests_needed(timeframe, start_time, end_time)
-        
-        print(f"\n📊 Fetching {timeframe} data for {symbol}")
-        print(f"Period: {datetime.fromtimestamp(start_time)} to {datetime.fromtimestamp(end_time)}")
-        print(f"Estimated requests: {requests_needed}")
-        print("-" * 40)
+        chunks = list(self._iter_timeframe_chunks(symbol, timeframe, start_time, end_time, concurrency))
+        return flatten_chunks(chunks)
+    
+    def download_timeframe_parquet(self, symbol: str, timeframe: str, start_time: int,
+                                   end_time: int, filepath: str, concurrency: int = 10) -> int:
+        """
+        Stream a timeframe into a Parquet file chunk by chunk, resuming after the
+        last candle already saved by a previous (possibly interrupted) run
+        
+        New rows go to numbered checkpoint files ('<name>.partial.0000.parquet',
+        ...), each closed after CHECKPOINT_CHUNKS chunks. A checkpoint is written
+        under a temporary name and only renamed once closed, so the ones on disk
+        are always readable: a run that is killed loses at most the chunks of
+        the checkpoint it was writing, and one that fails or is stopped closes
+        that checkpoint first. The next run resumes after the last saved candle,
+        and the checkpoints are merged into `filepath` once the whole period has
+        been fetched.
         
-        all_data = []
-        current_start = start_time_ms
-        request_count = 0
+        Args:
+            symbol: Trading pair
+            timeframe: Timeframe key (e.g., '1min', '5min')
+            start_time: Start time in Unix timestamp (seconds)
+            end_time: End time in Unix timestamp (seconds)
+            filepath: Output Parquet filename
+            concurrency: Maximum number of requests in flight at once
         
-        while current_start < end_time_ms:
-            # Calculate end time for this chunk (1000 candles max)
-            chunk_duration_ms = 1000 * minutes_per_candle * 60 * 1000  # 1000 candles in milliseconds
-            chunk_end = min(current_start + chunk_duration_ms, end_time_ms)
-            
-            request_count += 1
-            print(f"Request {request_count}/{requests_needed}: "
-                  f"{datetime.fromtimestamp(current_start/1000).strftime('%Y-%m-%d %H:%M')} to "
-                  f"{datetime.fromtimestamp(chunk_end/1000).strftime('%Y-%m-%d %H:%M')}")
-            
-            # Fetch data for this chunk
-            chunk_data = self.fetch_klines(symbol, interval, current_start, chunk_end, 1000)
-            
-            if chunk_data:
-                all_data.extend(chunk_data)
-                print(f"  ✓ Fetched {len(chunk_data)} records")
-            else:
-                print(f"  ❌ Failed to fetch data for this chunk")
-            
-            # Move to next chunk
-            if chunk_data and len(chunk_data) > 0:
-                # Use the close time of the last candle + 1 minute as next start
-                last_close_time = int(chunk_data[-1][6])  # Close time
-                current_start = last_close_time + (60 * 1000)  # Add 1 minute
-            else:
-                # If no data, move by the chunk duration
-                current_start = chunk_end + (minutes_per_candle * 60 * 1000)
-            
-            # Rate limiting delay
-            if current_start < end_time_ms and request_count < requests_needed:
-                time.sleep(delay)
+        Returns:
+            Number of records in the output file
         
-        print(f"✅ {timeframe}: {len(all_data):,} records fetched")
-        return all_data
+        Raises:
+            RuntimeError: A window could not be fetched or the download was
+                stopped; the rows before it are kept in the checkpoint files
+        """
+        base = os.path.splitext(filepath)[0]
+        step = self.timeframes[timeframe].minutes_per_candle * 60
+        
+        # Checkpoints still being written when a previous run was killed
+        for stale_path in glob.glob(f"{glob.escape(base)}.partial.*.parquet.tmp"):
+            os.remove(stale_path)
+        part_paths = sorted(glob.glob(f"{glob.escape(base)}.partial.*.parquet"))
+        
+        # The saved rows are the finished file, if any, followed by the checkpoints
+        # in order; each piece continues where the one before it stopped
+        candidates = ([filepath] if os.path.exists(filepath) else []) + part_paths
+        saved_paths = []
+        record_count = 0
+        resume_from = start_time
+        for i, candidate in enumerate(candidates):
+            try:
+                saved = pq.read_table(candidate, columns=['Timestamp'])
+            except (pa.ArrowInvalid, OSError) as e:
+                # Nothing after an unreadable piece can be used without leaving a gap
+                logger.warning("⚠️ Ignoring unreadable '%s' and the %d checkpoints after it: %s",
+                               candidate, len(candidates) - i - 1, e)
+                for path in candidates[i:]:
+                    if path != filepath:
+                        os.remove(path)
+                break
+            saved_paths.append(candidate)
+            record_count += saved.num_rows
+            last_timestamp = pc.max(saved['Timestamp']).as_py()
+            if last_timestamp is not None:
+                resume_from = max(resume_from, last_timestamp + step)
+        
+        if saved_paths == [filepath] and resume_from > end_time:
+            logger.info("⏭️ %s: '%s' is already complete (%s records)", timeframe, filepath,
+                        f"{record_count:,}")
+            return record_count
+        
+        if record_count:
+            logger.info("↪️ %s: resuming after %s saved records", timeframe, f"{record_count:,}")
+        
+        next_part = len(part_paths)
+        writer = None
+        part_path = None
+        chunks_in_part = 0
+        try:
+            if resume_from <= end_time:
+                for chunk_data in self._iter_timeframe_chunks(symbol, timeframe, resume_from,
+                                                              end_time, concurrency):
+                    if writer is None:
+                        part_path = f"{base}.partial.{next_part:04d}.parquet"
+                        writer = pq.ParquetWriter(f"{part_path}.tmp", KLINE_SCHEMA,
+                                                  compression='zstd', use_dictionary=False)
+                        next_part += 1
+                    
+                    chunk_table = self._klines_to_table(self._build_klines(chunk_data))
+                    writer.write_table(chunk_table)
+                    record_count += chunk_table.num_rows
+                    chunks_in_part += 1
+                    
+                    if chunks_in_part == CHECKPOINT_CHUNKS:
+                        writer.close()
+                        os.replace(f"{part_path}.tmp", part_path)
+                        saved_paths.append(part_path)
+                        writer = None
+                        chunks_in_part = 0
+        except BaseException:
+            logger.warning("⚠️ %s: kept %s records in checkpoints of '%s' for the next run",
+                           timeframe, f"{record_count:,}", filepath)
+            raise
+        finally:
+            # Keep whatever the open checkpoint holds, whether or not the download finished
+            if writer is not None:
+                writer.close()
+                os.replace(f"{part_path}.tmp", part_path)
+                saved_paths.append(part_path)
+        
+        if saved_paths and saved_paths != [filepath]:
+            # Copy the pieces one row group at a time rather than loading them whole
+            merge_path = f"{filepath}.tmp"
+            with pq.ParquetWriter(merge_path, KLINE_SCHEMA, compression='zstd',
+                                  use_dictionary=False) as writer:
+                for path in saved_paths:
+                    saved = pq.ParquetFile(path)
+                    for i in range(saved.num_row_groups):
+                        writer.write_table(saved.read_row_group(i).cast(KLINE_SCHEMA))
+            os.replace(merge_path, filepath)
+            for path in saved_paths:
+                if path != filepath:
+                    os.remove(path)
+        
+        if record_count:
+            logger.info("💾 Saved to '%s' (%s records)", filepath, f"{record_count:,}")
+        return record_count
     
-    def save_to_csv(self, data: List, filename: str, timeframe: str) -> None:
+    def _run_one_timeframe(self, symbol: str, timeframe: str, start_time: int, end_time: int,
+                           output_dir: str, concurrency: int, file_format: str) -> Optional[str]:
         """
-        Convert kline data to DataFrame and save as CSV
+        Fetch and save a single timeframe
         
         Args:
-            data: List of kline data
-            filename: Output filename
-            timeframe: Timeframe for reference
+            symbol: Trading pair (e.g., 'BTCUSDT')
+            timeframe: Timeframe key (e.g., '1min', '5min')
+            start_time: Start time in Unix timestamp (seconds)
+            end_time: End time in Unix timestamp (seconds)
+            output_dir: Directory to save files
+            concurrency: Maximum number of requests in flight
+            file_format: Output format, 'parquet' or 'csv'
+        
+        Returns:
+            Output filename, or None if no data was retrieved
+
+        Raises:
+            RuntimeError: stop_event was set before or during the download
         """
-        if not data:
-            print(f"❌ No data to save for {timeframe}")
-            return
-        
-        # Define all column names from API response
-        columns = [
-            'open_time', 'open', 'high', 'low', 'close', 'volume',
-            'close_time', 'quote_asset_volume', 'number_of_trades',
-            'taker_buy_base_asset_volume', 'taker_buy_quote_asset_volume', 'ignore'
-        ]
-        
-        # Create DataFrame with all data
-        df = pd.DataFrame(data, columns=columns)
-        
-        # Convert numeric columns
-        numeric_columns = ['open', 'high', 'low', 'close', 'volume']
-        for col in numeric_columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
-        
-        # Convert timestamp to datetime
-        df['datetime'] = pd.to_datetime(df['open_time'], unit='ms')
-        
-        # Create the desired output format
-        output_df = pd.DataFrame({
-            'Timestamp': df['open_time'].astype(int) // 1000,  # Convert to seconds
-            'Open': df['open'],
-            'High': df['high'],
-            'Low': df['low'],
-            'Close': df['close'],
-            'Volume': df['volume'],
-            'Datetime': df['datetime']
-        })
-        
-        # Sort by timestamp and remove duplicates
-        output_df = output_df.sort_values('Timestamp').reset_index(drop=True)
-        initial_count = len(output_df)
-        output_df = output_df.drop_duplicates(subset=['Timestamp'], keep='first')
-        final_count = len(output_df)
-        
-        if initial_count != final_count:
-            print(f"  Removed {initial_count - final_count} duplicate records")
-        
-        # Save to CSV
-        output_df.to_csv(filename, index=False)
-        print(f"  💾 Saved to '{filename}' ({len(output_df):,} records)")
+        if self.stop_event.is_set():
+            raise RuntimeError(f"{timeframe}: stopped before starting")
+
+        # Generate filename
+        start_date = datetime.fromtimestamp(start_time).strftime('%Y%m%d')
+        end_date = datetime.fromtimestamp(end_time).strftime('%Y%m%d')
+        filename = f"{symbol}_{timeframe}_{start_date}_to_{end_date}.{file_format}"
+        filepath = os.path.join(output_dir, filename)
+        
+        # Calculate and display estimated requests
+        requests_needed = self.calculate_requests_needed(timeframe, start_time, end_time)
+        logger.info("📈 Processing %s (estimated %d requests)", timeframe, requests_needed)
+        
+        # Parquet output is streamed to disk and resumes where a previous run stopped
+        if file_format == 'parquet':
+            if not self.download_timeframe_parquet(symbol, timeframe, start_time, end_time,
+                                                   filepath, concurrency):
+                logger.warning("❌ No data retrieved for %s", timeframe)
+                return None
+            return filepath
+        
+        # Fetch data for this timeframe
+        timeframe_data = self.fetch_timeframe_data(symbol, timeframe, start_time, end_time,
+                                                   concurrency)
+        
+        if not timeframe_data:
+            logger.warning("❌ No data retrieved for %s", timeframe)
+            return None
+        
+        self.save_to_csv(timeframe_data, filepath, timeframe)
+        return filepath
     
     def download_all_timeframes(self, symbol: str, start_time: int, end_time: int, 
-                               output_dir: str = "crypto_data", delay: float = 0.1) -> Dict[str, str]:
+                               output_dir: str = "crypto_data", concurrency: int = 10,
+                               file_format: str = 'parquet') -> Dict[str, str]:
         """
         Download data for all timeframes
         
@@ -206,7 +298,8 @@ class MultiTimeframeBinanceDownloader:
             start_time: Start time in Unix timestamp (seconds)
             end_time: End time in Unix timestamp (seconds)
             output_dir: Directory to save files
-            delay: Delay between requests in seconds
+            concurrency: Maximum number of requests in flight per timeframe
+            file_format: Output format, 'parquet' or 'csv'
         
         Returns:
             Dictionary mapping timeframe to output filename
@@ -214,54 +307,59 @@ class MultiTimeframeBinanceDownloader:
         # Create output directory
         os.makedirs(output_dir, exist_ok=True)
         
-        # Generate date strings for filenames
-        start_date = datetime.fromtimestamp(start_time).strftime('%Y%m%d')
-        end_date = datetime.fromtimestamp(end_time).strftime('%Y%m%d')
-        
         output_files = {}
         successful_downloads = 0
         
-        print(f"🚀 Starting multi-timeframe download for {symbol}")
-        print(f"📅 Period: {datetime.fromtimestamp(start_time)} to {datetime.fromtimestamp(end_time)}")
-        print(f"💾 Output directory: {output_dir}")
-        print("=" * 60)
-        
-        for timeframe in self.timeframes.keys():
+        logger.info("🚀 Starting multi-timeframe download for %s", symbol)
+        logger.info("📅 Period: %s to %s", datetime.fromtimestamp(start_time), datetime.fromtimestamp(end_time))
+        logger.info("💾 Output directory: %s", output_dir)
+        
+        # Timeframes are independent, so they all progress at once over the shared
+        # session, which needs a connection for every request in flight
+        self.size_pool(len(self.timeframes) * concurrency)
+        self.stop_event.clear()
+        with ThreadPoolExecutor(max_workers=len(self.timeframes)) as executor:
+            futures = {
+                executor.submit(self._run_one_timeframe, symbol, timeframe, start_time, end_time,
+                                output_dir, concurrency, file_format): timeframe
+                for timeframe in self.timeframes
+            }
+            
             try:
-                # Generate filename
-                filename = f"{symbol}_{timeframe}_{start_date}_to_{end_date}.csv"
-                filepath = os.path.join(output_dir, filename)
-                
-                # Calculate and display estimated requests
-                requests_needed = self.calculate_requests_needed(timeframe, start_time, end_time)
-                print(f"\n📈 Processing {timeframe} (estimated {requests_needed} requests)")
-                
-                # Fetch data for this timeframe
-                timeframe_data = self.fetch_timeframe_data(symbol, timeframe, start_time, end_time, delay)
-                
-                # Save to CSV
-                if timeframe_data:
-                    self.save_to_csv(timeframe_data, filepath, timeframe)
-                    output_files[timeframe] = filepath
-                    successful_downloads += 1
-                else:
-                    print(f"❌ No data retrieved for {timeframe}")
-                
-            except Exception as e:
-                print(f"❌ Error processing {timeframe}: {e}")
-                continue
+                for future in as_completed(futures):
+                    timeframe = futures[future]
+                    try:
+                        filepath = future.result()
+                    except Exception as e:
+                        logger.error("❌ Error processing %s: %s", timeframe, e)
+                        continue
+                    
+                    if filepath:
+                        output_files[timeframe] = filepath
+                        successful_downloads += 1
+            except KeyboardInterrupt:
+                # Only the main thread sees Ctrl+C: tell the workers to stop at their
+                # next request, drop timeframes that have not started, and let the
+                # running ones wind down before re-raising
+                logger.warning("⏹️ Stopping the timeframe downloads...")
+                self.stop_event.set()
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+        
+        # Report in timeframe order rather than completion order
+        output_files = {tf: output_files[tf] for tf in self.timeframes if tf in output_files}
         
         # Summary
-        print("\n" + "=" * 60)
-        print(f"🎉 Download Summary: {successful_downloads}/{len(self.timeframes)} timeframes completed")
+        logger.info("🎉 Download Summary: %d/%d timeframes completed", successful_downloads,
+                    len(self.timeframes))
         
         for timeframe, filepath in output_files.items():
             try:
                 file_size = os.path.getsize(filepath) / (1024 * 1024)  # MB
-                df = pd.read_csv(filepath)
-                print(f"  ✅ {timeframe:>6}: {len(df):>8,} records | {file_size:>6.2f} MB")
+                df = pd.read_parquet(filepath) if file_format == 'parquet' else pd.read_csv(filepath)
+                logger.info("  ✅ %6s: %8s records | %6.2f MB", timeframe, f"{len(df):,}", file_size)
             except:
-                print(f"  ⚠️ {timeframe:>6}: File created but cannot read stats")
+                logger.warning("  ⚠️ %6s: File created but cannot read stats", timeframe)
         
         return output_files
 
@@ -275,10 +373,10 @@ def main():
     START_TIME = 1701388800  # Your start time (Dec 1, 2023)
     END_TIME = 1733011200    # Your end time (Dec 1, 2024)
     OUTPUT_DIR = "crypto_data"  # Directory to save files
-    DELAY = 0.1  # Delay between requests (seconds)
+    CONCURRENCY = 10  # Maximum number of requests in flight
     
-    print("🚀 Multi-Timeframe Binance Data Downloader")
-    print("=" * 50)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    logger.info("🚀 Multi-Timeframe Binance Data Downloader")
     
     try:
         # Initialize downloader
@@ -290,15 +388,15 @@ def main():
             start_time=START_TIME,
             end_time=END_TIME,
             output_dir=OUTPUT_DIR,
-            delay=DELAY
+            concurrency=CONCURRENCY
         )
         
-        print(f"\n✨ All downloads complete! Files saved in '{OUTPUT_DIR}' directory")
+        logger.info("✨ All downloads complete! Files saved in '%s' directory", OUTPUT_DIR)
         
     except KeyboardInterrupt:
-        print("\n⏹️ Process interrupted by user")
+        logger.warning("⏹️ Process interrupted by user")
     except Exception as e:
-        print(f"\n❌ Error: {e}")
+        logger.error("❌ Error: %s", e)
 
 
 if __name__ == "__main__":
@@ -1,23 +1,58 @@
+import numpy as np
 import pandas as pd
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 import os
 from datetime import datetime
-from typing import Dict, List
+from typing import Dict, List, Tuple
+
+from kline_csv import CSV_CONVERT_OPTIONS, to_output_table, volume_decimals, write_csv
+
+# Columns aggregated when resampling, and the column order of every output file
+OHLCV_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume']
+OUTPUT_COLUMNS = ['Timestamp', 'Open', 'High', 'Low', 'Close', 'Volume', 'Datetime']
+
+# Finer timeframe each timeframe is aggregated from (its period is a whole
+# multiple of the source period, and the periods share boundaries)
+SOURCE_TIMEFRAME = {
+    '5min': '1min',
+    '15min': '5min',
+    '30min': '15min',
+    '1h': '30min',
+    '4h': '1h',
+    '6h': '1h',
+    '12h': '4h',
+    '1d': '12h',
+    '1M': '1d'
+}
+
+# Timeframes whose candles are identical to another timeframe's; they reuse its
+# aggregation instead of resampling again
+TIMEFRAME_ALIASES = {
+    '1Y_monthly': '1M'
+}
+
+
+def parquet_sibling(csv_path: str) -> str:
+    """Path of the Parquet file written next to an output CSV"""
+    return f"{os.path.splitext(csv_path)[0]}.parquet"
+
 
 class TimeframeResampler:
     def __init__(self):
         # Define timeframes and their pandas resample codes
         self.timeframes = {
-            '1min': '1T',
-            '5min': '5T', 
-            '15min': '15T',
-            '30min': '30T',
-            '1h': '1H',
-            '4h': '4H',
-            '6h': '6H', 
-            '12h': '12H',
+            '1min': '1min',
+            '5min': '5min', 
+            '15min': '15min',
+            '30min': '30min',
+            '1h': '1h',
+            '4h': '4h',
+            '6h': '6h', 
+            '12h': '12h',
             '1d': '1D',
-            '1M': '1M',      # 1 Month
-            '1Y_monthly': 'M'  # Yearly data as monthly aggregation (12 rows)
+            '1M': '1MS',      # 1 Month, labelled by its first day
+            '1Y_monthly': '1MS'  # Yearly data as monthly aggregation (12 rows)
         }
         
         # OHLCV aggregation rules
@@ -31,10 +66,10 @@ class TimeframeResampler:
     
     def load_data(self, filename: str) -> pd.DataFrame:
         """
-        Load 1-minute data from CSV file
+        Load 1-minute data from a CSV or Parquet file
         
         Args:
-            filename: Path to the 1-minute CSV file
+            filename: Path to the 1-minute CSV or Parquet file
             
         Returns:
             DataFrame with properly formatted data
@@ -42,27 +77,34 @@ class TimeframeResampler:
         print(f"📂 Loading data from {filename}...")
         
         try:
-            # Read the CSV file
-            df = pd.read_csv(filename)
+            # Read the input file (the downloaders write Parquet by default). CSVs go
+            # through Arrow's multi-threaded reader, which types every column
+            # (including Datetime) in the same pass
+            if filename.endswith('.parquet'):
+                df = pd.read_parquet(filename)
+            else:
+                table = pacsv.read_csv(filename, convert_options=CSV_CONVERT_OPTIONS)
+                df = table.to_pandas(self_destruct=True)
+                del table
             
             # Validate required columns
-            required_cols = ['Timestamp', 'Open', 'High', 'Low', 'Close', 'Volume', 'Datetime']
+            required_cols = ['Timestamp', 'Open', 'High', 'Low', 'Close', 'Volume']
             missing_cols = [col for col in required_cols if col not in df.columns]
             
             if missing_cols:
                 raise ValueError(f"Missing required columns: {missing_cols}")
             
-            # Convert Datetime column to pandas datetime
-            df['Datetime'] = pd.to_datetime(df['Datetime'])
+            if 'Datetime' in df.columns:
+                # Convert Datetime column to pandas datetime (Parquet stores it in
+                # milliseconds; the Timestamp math below expects nanoseconds)
+                df['Datetime'] = pd.to_datetime(df['Datetime']).astype('datetime64[ns]')
+            else:
+                # CSVs are written without Datetime by default; rebuild it
+                df['Datetime'] = pd.to_datetime(df['Timestamp'], unit='s')
             
             # Set Datetime as index for resampling
             df.set_index('Datetime', inplace=True)
             
-            # Ensure numeric columns are properly typed
-            numeric_cols = ['Open', 'High', 'Low', 'Close', 'Volume']
-            for col in numeric_cols:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-            
             # Sort by datetime
             df.sort_index(inplace=True)
             
@@ -83,39 +125,96 @@ class TimeframeResampler:
             print(f"❌ Error loading data: {e}")
             raise
     
-    def resample_timeframe(self, df: pd.DataFrame, timeframe_code: str) -> pd.DataFrame:
+    def aggregate_ohlcv(self, ohlcv: pd.DataFrame, timeframe_code: str) -> pd.DataFrame:
         """
-        Resample data to specified timeframe
+        Aggregate OHLCV candles into a coarser timeframe
         
         Args:
-            df: Original 1-minute DataFrame
-            timeframe_code: Pandas resample code (e.g., '5T', '1H')
+            ohlcv: OHLCV DataFrame indexed by Datetime (1-minute or any finer timeframe)
+            timeframe_code: Pandas resample code (e.g., '5min', '1h')
             
         Returns:
-            Resampled DataFrame
+            Aggregated OHLCV DataFrame indexed by Datetime, without empty periods
         """
-        print(f"   🔄 Resampling to {timeframe_code}...")
-        
         # Resample using OHLCV aggregation rules
-        resampled = df[['Open', 'High', 'Low', 'Close', 'Volume']].resample(timeframe_code).agg(self.agg_rules)
+        resampled = ohlcv[OHLCV_COLUMNS].resample(timeframe_code).agg(self.agg_rules)
         
-        # Remove rows where no data exists (all NaN)
-        resampled = resampled.dropna()
+        # Remove periods without any candles. Their Open is NaN (Volume sums to 0,
+        # not NaN), so one column decides and a single mask replaces dropna()
+        return resampled[~np.isnan(resampled['Open'].to_numpy())]
+    
+    def format_output(self, ohlcv: pd.DataFrame) -> pd.DataFrame:
+        """
+        Turn a Datetime-indexed OHLCV DataFrame into the output column layout
         
+        Args:
+            ohlcv: OHLCV DataFrame indexed by Datetime
+            
+        Returns:
+            DataFrame with Timestamp, OHLCV and Datetime columns
+        """
         # Reset index to get Datetime as column
-        resampled.reset_index(inplace=True)
+        output = ohlcv.reset_index()
         
-        # Create Timestamp column (Unix timestamp in seconds)
-        resampled['Timestamp'] = (resampled['Datetime'].astype('int64') // 10**9).astype(int)
+        # Create Timestamp column (Unix timestamp in seconds) by reinterpreting the
+        # datetime64[ns] buffer as int64 instead of going through a pandas cast
+        output['Timestamp'] = output['Datetime'].values.view('int64') // 1_000_000_000
         
         # Reorder columns to match original format
-        resampled = resampled[['Timestamp', 'Open', 'High', 'Low', 'Close', 'Volume', 'Datetime']]
+        return output[OUTPUT_COLUMNS]
+    
+    def resample_all(self, df_1min: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+        """
+        Build every configured timeframe from the 1-minute data in one pass
+        
+        Each timeframe is aggregated from the nearest finer timeframe that divides
+        it (see SOURCE_TIMEFRAME) rather than from the 1-minute data, so the full
+        1-minute frame is scanned only once. First/max/min/last/sum all compose
+        under nested aggregation, so the candles are the same either way (Volume
+        sums can differ in the last bit because they are added in a different order;
+        they are rounded to the source precision when written).
+        Timeframes listed in TIMEFRAME_ALIASES reuse their target's candles.
+        
+        Args:
+            df_1min: 1-minute DataFrame indexed by Datetime
+            
+        Returns:
+            Dictionary mapping timeframe name to its output DataFrame
+        """
+        # Aggregated OHLCV frames (still indexed by Datetime) that coarser
+        # timeframes are built from. The 1-minute frame is used as is: both
+        # aggregate_ohlcv and format_output pick the columns they need, so
+        # copying out its OHLCV columns first would only duplicate it
+        aggregated = {'1min': df_1min}
+        results = {}
         
-        print(f"   ✅ Created {len(resampled):,} {timeframe_code} candles")
+        for timeframe_name, timeframe_code in self.timeframes.items():
+            try:
+                if timeframe_name == '1min':
+                    # For 1min, just use original data but ensure proper format
+                    resampled_df = self.format_output(aggregated['1min'])
+                    print(f"   ✅ Using original 1-minute data: {len(resampled_df):,} records")
+                elif timeframe_name in TIMEFRAME_ALIASES:
+                    # Same candles as an already built timeframe
+                    resampled_df = results[TIMEFRAME_ALIASES[timeframe_name]]
+                    print(f"   ✅ Reusing {TIMEFRAME_ALIASES[timeframe_name]} candles: {len(resampled_df):,} records")
+                    if timeframe_name == '1Y_monthly':
+                        print(f"   📅 Monthly data will show {len(resampled_df)} months of the year")
+                else:
+                    source = aggregated[SOURCE_TIMEFRAME[timeframe_name]]
+                    print(f"   🔄 Resampling to {timeframe_code} from {SOURCE_TIMEFRAME[timeframe_name]}...")
+                    aggregated[timeframe_name] = self.aggregate_ohlcv(source, timeframe_code)
+                    resampled_df = self.format_output(aggregated[timeframe_name])
+                    print(f"   ✅ Created {len(resampled_df):,} {timeframe_code} candles")
+            except Exception as e:
+                print(f"  ❌ {timeframe_name}: Error - {e}")
+                continue
+            
+            results[timeframe_name] = resampled_df
         
-        return resampled
+        return results
     
-    def process_all_timeframes(self, input_file: str, output_dir: str = None) -> Dict[str, str]:
+    def process_all_timeframes(self, input_file: str, output_dir: str = None) -> Dict[str, Tuple[str, int]]:
         """
         Process all timeframes and save to separate CSV files
         
@@ -124,7 +223,7 @@ class TimeframeResampler:
             output_dir: Directory to save output files (optional)
             
         Returns:
-            Dictionary mapping timeframe to output filename
+            Dictionary mapping timeframe to (output filename, record count)
         """
         # Load the 1-minute data
         df_1min = self.load_data(input_file)
@@ -148,26 +247,16 @@ class TimeframeResampler:
         print("   • 1Y_monthly: Yearly data as monthly summary (12 rows)")
         print("-" * 60)
         
-        for timeframe_name, timeframe_code in self.timeframes.items():
+        # Aggregate every timeframe up front, then write them out one by one
+        resampled_frames = self.resample_all(df_1min)
+        
+        # Aggregated volumes are written at the precision of the 1-minute ones
+        decimals = volume_decimals(df_1min['Volume'].to_numpy())
+        
+        for timeframe_name, resampled_df in resampled_frames.items():
             print(f"Processing {timeframe_name}...")
             
             try:
-                # Resample data
-                if timeframe_name == '1min':
-                    # For 1min, just use original data but ensure proper format
-                    resampled_df = df_1min.copy()
-                    resampled_df.reset_index(inplace=True)
-                    resampled_df['Timestamp'] = (resampled_df['Datetime'].astype('int64') // 10**9).astype(int)
-                    resampled_df = resampled_df[['Timestamp', 'Open', 'High', 'Low', 'Close', 'Volume', 'Datetime']]
-                    print(f"   ✅ Using original 1-minute data: {len(resampled_df):,} records")
-                elif timeframe_name == '1Y_monthly':
-                    # Special handling for yearly data as monthly aggregation
-                    print(f"   🔄 Creating monthly aggregation for yearly view...")
-                    resampled_df = self.resample_timeframe(df_1min, timeframe_code)
-                    print(f"   📅 Monthly data will show {len(resampled_df)} months of the year")
-                else:
-                    resampled_df = self.resample_timeframe(df_1min, timeframe_code)
-                
                 # Generate output filename
                 if timeframe_name == '1Y_monthly':
                     output_filename = f"{base_name}_yearly_monthly.csv"
@@ -176,9 +265,12 @@ class TimeframeResampler:
                 
                 output_path = os.path.join(output_dir, output_filename)
                 
-                # Save to CSV
-                resampled_df.to_csv(output_path, index=False)
-                output_files[timeframe_name] = output_path
+                # Save to CSV, plus a zstd Parquet copy that is smaller, typed and
+                # can report its row count without being parsed
+                output_table = to_output_table(resampled_df, decimals)
+                write_csv(output_table, output_path)
+                pq.write_table(output_table, parquet_sibling(output_path), compression='zstd')
+                output_files[timeframe_name] = (output_path, len(resampled_df))
                 
                 # Special message for yearly monthly data
                 if timeframe_name == '1Y_monthly':
@@ -213,12 +305,13 @@ class TimeframeResampler:
         
         return output_files
     
-    def generate_summary_report(self, output_files: Dict[str, str]) -> None:
+    def generate_summary_report(self, output_files: Dict[str, Tuple[str, int]]) -> None:
         """
         Generate a summary report of all created files
         
         Args:
-            output_files: Dictionary of timeframe to filename mappings
+            output_files: Dictionary of timeframe to (filename, record count),
+                as returned by process_all_timeframes
         """
         print("\n" + "="*70)
         print("📊 SUMMARY REPORT")
@@ -237,12 +330,10 @@ class TimeframeResampler:
             print(f"📈 {group_name}:")
             for timeframe in timeframes:
                 if timeframe in output_files:
-                    filepath = output_files[timeframe]
+                    filepath, record_count = output_files[timeframe]
                     try:
                         file_size = os.path.getsize(filepath)
                         size_mb = file_size / (1024 * 1024)
-                        df = pd.read_csv(filepath)
-                        record_count = len(df)
                         
                         # Special descriptions for new timeframes
                         if timeframe == '1M':
@@ -265,11 +356,7 @@ class TimeframeResampler:
         # Calculate data reduction ratios
         original_records = None
         if '1min' in output_files:
-            try:
-                df_1min = pd.read_csv(output_files['1min'])
-                original_records = len(df_1min)
-            except:
-                pass
+            original_records = output_files['1min'][1]
         
         if original_records:
             print("💡 Data Reduction Examples:")
@@ -288,7 +375,7 @@ class TimeframeResampler:
         print("   • Use short-term files for day trading, long-term for investment analysis")
         
         print("\n🎉 All timeframes generated successfully!")
-        print(f"📁 Files saved in: {os.path.dirname(list(output_files.values())[0])}")
+        print(f"📁 Files saved in: {os.path.dirname(list(output_files.values())[0][0])}")
 
 
 def main():
@@ -310,6 +397,7 @@ def main():
         print("\n💡 Expected filename format:")
         print("   • BTCUSDT_1min_20231201_to_20241201.csv")
         print("   • bybit_BTCUSDT_1min_20231201_to_20241201.csv")
+        print("   • BTCUSDT_1min_20231201_to_20241201.parquet")
         print("   • Or any CSV with: Timestamp,Open,High,Low,Close,Volume,Datetime")
         return
     
@@ -1,15 +1,51 @@
 import requests
+import numpy as np
+import orjson
 import pandas as pd
-import time
-import math
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
-def fetch_bybit_klines(symbol, interval, start_time, end_time, limit=1000):
+from bybit_client import MAX_RETRIES, get_klines, size_pool
+from kline_csv import open_csv_output, to_csv_text
+
+# Most klines Bybit returns for one request
+MAX_KLINES_PER_REQUEST = 1000
+# Requests in flight at once
+CONCURRENCY = 8
+# Progress lines logged over a full download
+PROGRESS_UPDATES = 20
+
+logger = logging.getLogger(__name__)
+
+# Keep a pooled connection for every request in flight
+size_pool(CONCURRENCY)
+
+# Layout of the output CSV (Datetime at second resolution prints as
+# '2024-01-01 00:00:00')
+CSV_SCHEMA = pa.schema([
+    ('Timestamp', pa.int64()),
+    ('Open', pa.float64()),
+    ('High', pa.float64()),
+    ('Low', pa.float64()),
+    ('Close', pa.float64()),
+    ('Volume', pa.float64()),
+    ('Datetime', pa.timestamp('s'))
+])
+
+def fetch_bybit_klines(symbol, interval, start_time, end_time, limit=MAX_KLINES_PER_REQUEST):
     """
     Fetch Bybit klines data with improved error handling
-    """
-    url = "https://api.bybit.com/v5/market/kline"
     
+    Returns:
+        Parsed klines (see parse_klines), empty if the window has no candles, or
+        None if the request failed
+    """
     params = {
         'category': 'spot',
         'symbol': symbol,
@@ -19,165 +55,218 @@ def fetch_bybit_klines(symbol, interval, start_time, end_time, limit=1000):
         'limit': limit
     }
     
-    for attempt in range(5):  # Increased retry attempts
-        try:
-            # Add session with connection pooling
-            session = requests.Session()
-            session.headers.update({'User-Agent': 'Mozilla/5.0'})
-            
-            response = session.get(url, params=params, timeout=60)
-            response.raise_for_status()
-            data = response.json()
-            
-            session.close()
-            
-            if data.get('retCode') == 0 and data.get('result', {}).get('list'):
-                klines = data['result']['list']
-                print(f"✅ Successfully fetched {len(klines)} records")
-                return klines
-            else:
-                print(f"⚠️ No data returned: {data.get('retMsg', 'Unknown error')}")
-                return []
-                
-        except requests.exceptions.Timeout:
-            print(f"⏰ Timeout on attempt {attempt + 1}")
-            if attempt < 4:
-                time.sleep(5 * (attempt + 1))  # Exponential backoff
-            continue
-        except requests.exceptions.ConnectionError as e:
-            print(f"🔌 Connection error on attempt {attempt + 1}: {e}")
-            if attempt < 4:
-                time.sleep(5 * (attempt + 1))  # Exponential backoff
-            continue
-        except requests.exceptions.RequestException as e:
-            print(f"❌ Request error on attempt {attempt + 1}: {e}")
-            if attempt < 4:
-                time.sleep(5 * (attempt + 1))  # Exponential backoff
-            continue
-        except Exception as e:
-            print(f"❌ Unexpected error on attempt {attempt + 1}: {e}")
-            if attempt < 4:
-                time.sleep(5 * (attempt + 1))
-            continue
+    try:
+        data = get_klines(params)
+    except requests.exceptions.RequestException as e:
+        logger.error("❌ Failed to fetch data after %d retries: %s", MAX_RETRIES, e)
+        return None
+    except orjson.JSONDecodeError as e:
+        logger.error("❌ Error decoding response: %s", e)
+        return None
     
-    print(f"❌ Failed to fetch data after 5 attempts")
-    return []
+    if data.get('retCode') != 0:
+        logger.error("❌ API error: %s", data.get('retMsg', 'Unknown error'))
+        return None
+    
+    if data.get('result', {}).get('list'):
+        klines = data['result']['list']
+        logger.debug("✅ Successfully fetched %d records", len(klines))
+        # Parse in the worker thread, so the main loop only receives typed arrays
+        return parse_klines(klines)
+    else:
+        logger.warning("⚠️ No data returned: %s", data.get('retMsg', 'Unknown error'))
+        return parse_klines([])
 
-def klines_to_dataframe(klines_data):
-    """Convert Bybit klines data to DataFrame with required format"""
-    if not klines_data:
-        return pd.DataFrame()
+def parse_klines(klines):
+    """
+    Convert raw Bybit klines to typed columns
     
-    # Bybit format: [startTime, openPrice, highPrice, lowPrice, closePrice, volume, turnover]
-    rows = []
+    Bybit format: [startTime, openPrice, highPrice, lowPrice, closePrice, volume, turnover],
+    all fields strings.
     
-    for kline in klines_data:
-        timestamp_ms = int(kline[0])
-        timestamp_s = timestamp_ms // 1000  # Convert to seconds
-        
-        row = {
-            'Timestamp': timestamp_s,
-            'Open': float(kline[1]),
-            'High': float(kline[2]),
-            'Low': float(kline[3]),
-            'Close': float(kline[4]),
-            'Volume': float(kline[5]),
-            'Datetime': pd.to_datetime(timestamp_ms, unit='ms')
-        }
-        rows.append(row)
-    
-    df = pd.DataFrame(rows)
+    Returns:
+        (timestamp_ms, ohlcv): int64 start times in milliseconds and a float64
+        array of shape (N, 5), in the order Bybit returned them
+    """
+    if not klines:
+        return np.empty(0, dtype=np.int64), np.empty((0, 5), dtype=np.float64)
     
-    # Remove timezone to avoid compatibility issues
-    df['Datetime'] = df['Datetime'].dt.tz_localize(None)
+    # Convert whole columns at once instead of row by row
+    data = np.asarray(klines)
+    return data[:, 0].astype(np.int64), data[:, 1:6].astype(np.float64)
+
+def klines_to_dataframe(timestamp_ms, ohlcv):
+    """Convert parsed klines to a sorted, de-duplicated DataFrame with required format"""
+    if len(timestamp_ms) == 0:
+        return pd.DataFrame()
     
-    # Sort by timestamp (oldest first for chronological order)
-    df = df.sort_values('Timestamp').reset_index(drop=True)
+    # Keep the first kline of each timestamp, oldest first: np.unique returns
+    # the sorted unique timestamps and where each first occurs, which sorts
+    # and de-duplicates every column in one step
+    timestamp_ms, first = np.unique(timestamp_ms, return_index=True)
+    ohlcv = ohlcv[first]
     
-    return df
+    return pd.DataFrame({
+        'Timestamp': timestamp_ms // 1000,  # Convert to seconds
+        'Open': ohlcv[:, 0],
+        'High': ohlcv[:, 1],
+        'Low': ohlcv[:, 2],
+        'Close': ohlcv[:, 3],
+        'Volume': ohlcv[:, 4],
+        'Datetime': pd.to_datetime(timestamp_ms, unit='ms')  # naive UTC
+    })
 
-def save_to_csv(df, filename):
-    """Save DataFrame to CSV file"""
-    if df.empty:
-        print(f"No data to save for {filename}")
-        return
+def chunk_to_batch(timestamp_ms, ohlcv, last_timestamp):
+    """
+    Convert one chunk of klines to an Arrow record batch of new candles
     
-    try:
-        df.to_csv(filename, index=False)
-        print(f"✅ Saved {len(df)} records to {filename}")
-        print(f"📅 Date range: {df['Datetime'].min()} to {df['Datetime'].max()}")
-        
-        # Show file size
-        import os
-        file_size_mb = os.path.getsize(filename) / (1024 * 1024)
-        print(f"📁 File size: {file_size_mb:.2f} MB")
-        
-    except Exception as e:
-        print(f"❌ Error saving {filename}: {e}")
+    Args:
+        timestamp_ms, ohlcv: Parsed klines as returned by fetch_bybit_klines
+        last_timestamp: Last Timestamp already written (chunks arrive in
+            chronological order, so anything at or before it is a duplicate)
+    """
+    # Already sorted and free of repeats within the chunk
+    df = klines_to_dataframe(timestamp_ms, ohlcv)
+    df = df[df['Timestamp'].to_numpy() > last_timestamp]
+    
+    return pa.RecordBatch.from_pandas(df, schema=CSV_SCHEMA, preserve_index=False)
 
-def fetch_1min_data_chunked(symbol, start_time, end_time):
+def fetch_1min_data_chunked(symbol, start_time, end_time, filename):
     """
     Fetch 1-minute data for the entire year by chunking into manageable pieces
+    
+    Each chunk is appended to the CSV as soon as it arrives instead of holding
+    the whole year in memory. The rows go to '<name>.partial.csv' first, which
+    only replaces filename once every window has been fetched.
+    
+    Returns:
+        Summary of what was written (records, duplicates, date and price range,
+        total volume and the first rows), or None if no data was retrieved
+    
+    Raises:
+        RuntimeError: A window could not be fetched; the rows before it are
+            kept in the partial file
     """
     print("🚀 Starting 1-minute data download for full year...")
     print(f"Symbol: {symbol}")
     print(f"Start: {datetime.fromtimestamp(start_time)} ({start_time})")
     print(f"End: {datetime.fromtimestamp(end_time)} ({end_time})")
     
-    # Calculate total duration and estimated requests
+    summary = None
+    file = writer = None
+    complete = False
+    
+    # Keeps the extension, and so the compression, of the final name
+    root, ext = os.path.splitext(filename)
+    partial_path = f"{root}.partial{ext}"
+    
+    # A window includes both its start and end minute, so spanning one minute
+    # less than the request limit returns every candle in it (a 1000-minute span
+    # holds 1001 candles, and Bybit would drop the oldest)
+    chunk_size_minutes = MAX_KLINES_PER_REQUEST - 1
+    chunk_size_seconds = chunk_size_minutes * 60
+    
+    # Every window is known up front: each one starts one minute after the
+    # previous window's (inclusive) end, so windows neither overlap nor leave gaps.
+    # end_time is inclusive too, so it needs a window even when it falls exactly
+    # on the start of the next one
+    starts = np.arange(start_time, end_time + 1, MAX_KLINES_PER_REQUEST * 60, dtype=np.int64)
+    ends = np.minimum(starts + chunk_size_seconds, end_time)
+    windows = list(zip(starts.tolist(), ends.tolist()))
+    
+    # Calculate total duration; the window list is the exact request count
     total_seconds = end_time - start_time
     total_minutes = total_seconds // 60
-    estimated_requests = math.ceil(total_minutes / 1000)
+    total_requests = len(windows)
+    progress_step = max(1, total_requests // PROGRESS_UPDATES)
     
     print(f"📊 Total duration: {total_seconds // 86400} days")
     print(f"📈 Total minutes: {total_minutes:,}")
-    print(f"🔢 Estimated requests: {estimated_requests}")
+    print(f"🔢 Requests: {total_requests}")
     print("="*60)
     
-    all_data = []
-    current_start = start_time
-    request_count = 0
-    
-    # Use 16.5-hour chunks (1000 minutes = 16 hours 40 minutes)
-    chunk_size_minutes = 1000
-    chunk_size_seconds = chunk_size_minutes * 60
-    
-    while current_start < end_time:
-        request_count += 1
-        chunk_end = min(current_start + chunk_size_seconds, end_time)
-        
-        start_str = datetime.fromtimestamp(current_start).strftime('%Y-%m-%d %H:%M')
-        end_str = datetime.fromtimestamp(chunk_end).strftime('%Y-%m-%d %H:%M')
-        
-        print(f"\n📦 Request {request_count}/{estimated_requests}")
-        print(f"   Period: {start_str} to {end_str}")
-        print(f"   Duration: {(chunk_end - current_start) / 3600:.1f} hours")
-        
-        # Fetch chunk data
-        chunk_data = fetch_bybit_klines(symbol, '1', current_start, chunk_end, 1000)
-        
-        if chunk_data:
-            all_data.extend(chunk_data)
-            print(f"   📈 Total records collected: {len(all_data):,}")
+    # Fetch several windows at once; the shared token bucket keeps the request
+    # rate under Bybit's limit instead of sleeping between requests
+    try:
+        with ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+            # map() yields results in submission order, so chunks stay chronological
+            results = executor.map(
+                lambda window: fetch_bybit_klines(symbol, '1', window[0], window[1]),
+                windows
+            )
             
-            # Show progress percentage
-            progress = (current_start - start_time) / (end_time - start_time) * 100
-            print(f"   📊 Progress: {progress:.1f}%")
-        else:
-            print(f"   ❌ No data retrieved for this chunk")
-        
-        # Move to next chunk
-        current_start = chunk_end + 60  # Add 1 minute to avoid overlap
-        
-        # Rate limiting - be conservative for large downloads
-        if current_start < end_time:
-            print(f"   ⏱️  Waiting 2 seconds...")
-            time.sleep(2)
+            for request_count, ((chunk_start, chunk_end), chunk) in enumerate(zip(windows, results), 1):
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("📦 Request %d/%d: %s to %s", request_count, total_requests,
+                                 datetime.fromtimestamp(chunk_start).strftime('%Y-%m-%d %H:%M'),
+                                 datetime.fromtimestamp(chunk_end).strftime('%Y-%m-%d %H:%M'))
+                
+                if chunk is None:
+                    # Stop at the first failed window rather than skipping it, so
+                    # the output never has a silent gap in the middle
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    raise RuntimeError(
+                        f"Request {request_count}/{total_requests}: failed to fetch "
+                        f"{datetime.fromtimestamp(chunk_start).strftime('%Y-%m-%d %H:%M')} to "
+                        f"{datetime.fromtimestamp(chunk_end).strftime('%Y-%m-%d %H:%M')}")
+                timestamp_ms, ohlcv = chunk
+                
+                if len(timestamp_ms) == 0:
+                    logger.warning("❌ No data retrieved for chunk starting %s",
+                                   datetime.fromtimestamp(chunk_start).strftime('%Y-%m-%d %H:%M'))
+                    continue
+                
+                if summary is None:
+                    summary = {'records': 0, 'duplicates': 0, 'low': float('inf'),
+                               'high': float('-inf'), 'volume': 0.0}
+                
+                batch = chunk_to_batch(timestamp_ms, ohlcv, summary.get('last_timestamp', -1))
+                summary['duplicates'] += len(timestamp_ms) - batch.num_rows
+                
+                if batch.num_rows:
+                    # Same text as the other outputs; a chunk is only part of the
+                    # file, so Datetime always keeps its time
+                    text = to_csv_text(pa.Table.from_batches([batch]), date_only=False)
+                    if writer is None:
+                        # Arrow quotes header names, so write the plain header line ourselves
+                        file = open_csv_output(partial_path)
+                        file.write((','.join(text.column_names) + '\n').encode())
+                        writer = pacsv.CSVWriter(file, text.schema, write_options=pacsv.WriteOptions(
+                            include_header=False, quoting_style='none'))
+                    writer.write_table(text)
+                    
+                    # Keep running statistics for the final report
+                    if summary['records'] == 0:
+                        summary['first_datetime'] = batch['Datetime'][0].as_py()
+                        summary['sample'] = batch.slice(0, 5).to_pandas()
+                    summary['records'] += batch.num_rows
+                    summary['last_timestamp'] = batch['Timestamp'][-1].as_py()
+                    summary['last_datetime'] = batch['Datetime'][-1].as_py()
+                    summary['low'] = min(summary['low'], pc.min(batch['Low']).as_py())
+                    summary['high'] = max(summary['high'], pc.max(batch['High']).as_py())
+                    summary['volume'] += pc.sum(batch['Volume']).as_py()
+                
+                # One progress line every few percent instead of several per request
+                if request_count % progress_step == 0:
+                    logger.info("📊 %d/%d requests (%.0f%%), %s records collected", request_count,
+                                total_requests, request_count / total_requests * 100,
+                                f"{summary['records']:,}")
+        complete = True
+    finally:
+        if writer is not None:
+            writer.close()
+        if file is not None:
+            file.close()
+            if complete:
+                os.replace(partial_path, filename)
+            else:
+                logger.warning("⚠️ Download incomplete: kept the rows fetched so far in '%s'",
+                               partial_path)
     
     print(f"\n✅ Data collection complete!")
-    print(f"📊 Total records collected: {len(all_data):,}")
+    print(f"📊 Total records collected: {summary['records'] if summary else 0:,}")
     
-    return all_data
+    return summary
 
 def main():
     """
@@ -187,11 +276,17 @@ def main():
     SYMBOL = "BTCUSDT"
     START_TIME = 1701388800  # Dec 1, 2023
     END_TIME = 1733011200    # Dec 1, 2024
+    COMPRESS = False  # Write a gzip-compressed .csv.gz instead of a plain CSV
+    
+    # Progress goes through logging; use DEBUG to see every request
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
     
     # Generate filename
     start_date = datetime.fromtimestamp(START_TIME).strftime('%Y%m%d')
     end_date = datetime.fromtimestamp(END_TIME).strftime('%Y%m%d')
     filename = f"bybit_{SYMBOL}_1min_{start_date}_to_{end_date}.csv"
+    if COMPRESS:
+        filename += '.gz'
     
     print("🚀 Bybit 1-Minute Data Downloader")
     print("="*50)
@@ -204,59 +299,49 @@ def main():
         # Test API connection first
         print("🔍 Testing API connection...")
         test_data = fetch_bybit_klines(SYMBOL, '1', START_TIME, START_TIME + 3600, 5)
-        if not test_data:
+        if test_data is None or len(test_data[0]) == 0:
             print("❌ API connection test failed! Check symbol and internet connection.")
-            return
+            sys.exit(1)
         print("✅ API connection successful!")
         
-        # Fetch all 1-minute data
-        all_klines = fetch_1min_data_chunked(SYMBOL, START_TIME, END_TIME)
+        # Fetch all 1-minute data, writing it to CSV as it arrives
+        summary = fetch_1min_data_chunked(SYMBOL, START_TIME, END_TIME, filename)
         
-        if all_klines:
-            print(f"\n📊 Converting {len(all_klines):,} records to DataFrame...")
+        if summary and summary['records']:
+            if summary['duplicates']:
+                print(f"🧹 Removed {summary['duplicates']} duplicate records")
             
-            # Convert to DataFrame
-            df = klines_to_dataframe(all_klines)
+            print(f"✅ Saved {summary['records']} records to {filename}")
             
-            if not df.empty:
-                # Remove duplicates (in case of overlapping data)
-                initial_count = len(df)
-                df = df.drop_duplicates(subset=['Timestamp'], keep='first')
-                final_count = len(df)
-                
-                if initial_count != final_count:
-                    print(f"🧹 Removed {initial_count - final_count} duplicate records")
-                
-                # Save to CSV
-                print(f"\n💾 Saving data to CSV...")
-                save_to_csv(df, filename)
-                
-                # Show summary statistics
-                print(f"\n📈 Data Summary:")
-                print(f"   Records: {len(df):,}")
-                print(f"   Date range: {df['Datetime'].min()} to {df['Datetime'].max()}")
-                print(f"   Price range: ${df['Low'].min():.2f} - ${df['High'].max():.2f}")
-                print(f"   Total volume: {df['Volume'].sum():,.2f}")
-                
-                # Show sample data
-                print(f"\n📋 Sample data (first 5 rows):")
-                sample_cols = ['Datetime', 'Open', 'High', 'Low', 'Close', 'Volume']
-                print(df[sample_cols].head().to_string(index=False))
-                
-                print(f"\n🎉 Success! Data saved to '{filename}'")
-                
-            else:
-                print("❌ No data was converted to DataFrame")
+            # Show file size
+            file_size_mb = os.path.getsize(filename) / (1024 * 1024)
+            print(f"📁 File size: {file_size_mb:.2f} MB")
+            
+            # Show summary statistics
+            print(f"\n📈 Data Summary:")
+            print(f"   Records: {summary['records']:,}")
+            print(f"   Date range: {summary['first_datetime']} to {summary['last_datetime']}")
+            print(f"   Price range: ${summary['low']:.2f} - ${summary['high']:.2f}")
+            print(f"   Total volume: {summary['volume']:,.2f}")
+            
+            # Show sample data
+            print(f"\n📋 Sample data (first 5 rows):")
+            sample_cols = ['Datetime', 'Open', 'High', 'Low', 'Close', 'Volume']
+            print(summary['sample'][sample_cols].to_string(index=False))
+            
+            print(f"\n🎉 Success! Data saved to '{filename}'")
         else:
             print("❌ No data was collected")
             
     except KeyboardInterrupt:
         print("\n⏹️ Process interrupted by user")
-        print("💡 Partial data may have been collected. Check for any existing CSV file.")
+        print("💡 Partial data may have been collected. Check for a .partial.csv file.")
+        sys.exit(1)
     except Exception as e:
         print(f"\n❌ Error: {e}")
         import traceback
         traceback.print_exc()
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
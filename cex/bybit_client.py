@@ -0,0 +1,72 @@
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from rate_limiter import TokenBucket
+
+KLINE_URL = "https://api.bybit.com/v5/market/kline"
+MAX_RETRIES = 5
+# Bybit allows 600 requests per 5-second window per IP on market endpoints
+RATE_LIMIT_REQUESTS = 600
+RATE_LIMIT_WINDOW_SECONDS = 5
+
+# One session for every Bybit request in the process so TCP/TLS connections are
+# pooled and reused
+SESSION = requests.Session()
+SESSION.headers.update({'User-Agent': 'Mozilla/5.0'})
+
+# Request budget shared by every worker thread of every script: a full window's
+# worth of burst, refilled continuously at the window's average rate (120 requests/s)
+RATE_LIMITER = TokenBucket(capacity=RATE_LIMIT_REQUESTS,
+                           refill_per_sec=RATE_LIMIT_REQUESTS / RATE_LIMIT_WINDOW_SECONDS)
+
+_pool_size = 0
+
+
+def size_pool(max_connections: int) -> None:
+    """
+    Make room in the keep-alive pool for at least max_connections requests in
+    flight, retrying timeouts, connection errors and retryable statuses with backoff
+
+    The pool only ever grows, so scripts sharing the session can each ask for
+    what they need in any order.
+    """
+    global _pool_size
+    if max_connections <= _pool_size:
+        return
+
+    SESSION.mount('https://', HTTPAdapter(
+        pool_connections=8,
+        pool_maxsize=max_connections,
+        max_retries=Retry(
+            total=MAX_RETRIES,
+            backoff_factor=1,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(['GET'])
+        )
+    ))
+    _pool_size = max_connections
+
+
+def get_klines(params: dict) -> dict:
+    """
+    Send one kline request under the shared rate limit and decode the response
+
+    Args:
+        params: Query parameters for /v5/market/kline
+
+    Returns:
+        The decoded JSON response
+
+    Raises:
+        requests.exceptions.RequestException: The request still failed after retries
+        orjson.JSONDecodeError: The response body is not valid JSON
+    """
+    RATE_LIMITER.acquire()
+
+    # Timeouts, connection errors and retryable statuses are retried with
+    # backoff by the session's adapter
+    response = SESSION.get(KLINE_URL, params=params, timeout=60)
+    response.raise_for_status()
+    return orjson.loads(response.content)
@@ -1,14 +1,65 @@
 import requests
+import numpy as np
+import orjson
 import pandas as pd
+import pyarrow.parquet as pq
+import logging
+import os
+import threading
 import time
-import math
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
-def fetch_bybit_klines(symbol, interval, start_time, end_time, limit=1000):
+from bybit_client import MAX_RETRIES, get_klines, size_pool
+from kline_cache import KlineCache
+from kline_csv import to_output_table, write_csv
+
+logger = logging.getLogger(__name__)
+
+# Requests in flight at once per timeframe
+CONCURRENCY = 6
+# Timeframes downloaded in parallel by fetch_all_timeframes
+TIMEFRAME_WORKERS = 8
+# SQLite file (in the working directory) holding already-downloaded chunks
+CACHE_PATH = '.bybit_cache.sqlite'
+
+# Minutes per candle for each Bybit interval
+INTERVAL_MINUTES = {
+    '5': 5, '15': 15, '30': 30, '60': 60, 
+    '240': 240, '360': 360, '720': 720, 'D': 1440
+}
+
+# Keep a pooled connection for every request in flight across all timeframes
+size_pool(CONCURRENCY * TIMEFRAME_WORKERS)
+
+# Responses for fully closed chunks, reused across runs; opened by
+# fetch_all_timeframes so that importing this module creates no file
+_CACHE = None
+
+# Keeps multi-line reports from concurrent timeframes from interleaving
+_PRINT_LOCK = threading.Lock()
+
+# Set on Ctrl+C so running timeframes stop at their next request (worker
+# threads never see KeyboardInterrupt themselves)
+_STOP = threading.Event()
+
+def fetch_bybit_klines(symbol, interval, start_time, end_time, limit=1000, use_cache=True):
     """
     Fetch Bybit klines data with improved error handling
+    
+    Once the on-disk cache has been opened, chunks whose candles have all
+    closed are served from it when they have been downloaded before; pass
+    use_cache=False to always go to the API.
     """
-    url = "https://api.bybit.com/v5/market/kline"
+    if _STOP.is_set():
+        return []
+    
+    cache = _CACHE if use_cache else None
+    if cache is not None:
+        cached = cache.get(symbol, interval, start_time, end_time, limit)
+        if cached is not None:
+            logger.debug("✅ Loaded %d records from cache", len(cached))
+            return cached
     
     params = {
         'category': 'spot',
@@ -19,96 +70,81 @@ def fetch_bybit_klines(symbol, interval, start_time, end_time, limit=1000):
         'limit': limit
     }
     
-    for attempt in range(5):  # Increased retry attempts
-        try:
-            # Add session with connection pooling
-            session = requests.Session()
-            session.headers.update({'User-Agent': 'Mozilla/5.0'})
-            
-            response = session.get(url, params=params, timeout=60)
-            response.raise_for_status()
-            data = response.json()
-            
-            session.close()
-            
-            if data.get('retCode') == 0 and data.get('result', {}).get('list'):
-                klines = data['result']['list']
-                print(f"✅ Successfully fetched {len(klines)} records")
-                return klines
-            else:
-                print(f"⚠️ No data returned: {data.get('retMsg', 'Unknown error')}")
-                return []
-                
-        except requests.exceptions.Timeout:
-            print(f"⏰ Timeout on attempt {attempt + 1}")
-            if attempt < 4:
-                time.sleep(5 * (attempt + 1))  # Exponential backoff
-            continue
-        except requests.exceptions.ConnectionError as e:
-            print(f"🔌 Connection error on attempt {attempt + 1}: {e}")
-            if attempt < 4:
-                time.sleep(5 * (attempt + 1))  # Exponential backoff
-            continue
-        except requests.exceptions.RequestException as e:
-            print(f"❌ Request error on attempt {attempt + 1}: {e}")
-            if attempt < 4:
-                time.sleep(5 * (attempt + 1))  # Exponential backoff
-            continue
-        except Exception as e:
-            print(f"❌ Unexpected error on attempt {attempt + 1}: {e}")
-            if attempt < 4:
-                time.sleep(5 * (attempt + 1))
-            continue
-    
-    print(f"❌ Failed to fetch data after 5 attempts")
-    return []
+    try:
+        data = get_klines(params)
+    except requests.exceptions.RequestException as e:
+        logger.error("❌ Failed to fetch data after %d retries: %s", MAX_RETRIES, e)
+        return []
+    except orjson.JSONDecodeError as e:
+        logger.error("❌ Error decoding response: %s", e)
+        return []
+    
+    if data.get('retCode') == 0 and data.get('result', {}).get('list'):
+        klines = data['result']['list']
+        logger.debug("✅ Successfully fetched %d records", len(klines))
+        
+        # Only cache once the last candle in the window has closed; a window
+        # reaching the present could still grow or change
+        if (cache is not None and interval in INTERVAL_MINUTES
+                and end_time + INTERVAL_MINUTES[interval] * 60 <= time.time()):
+            cache.set(symbol, interval, start_time, end_time, limit, klines)
+        return klines
+    else:
+        logger.warning("⚠️ No data returned: %s", data.get('retMsg', 'Unknown error'))
+        return []
 
 def klines_to_dataframe(klines_data):
-    """Convert Bybit klines data to DataFrame with required format"""
-    if not klines_data:
+    """
+    Convert Bybit klines data to DataFrame with required format
+    
+    klines_data is either the list returned by fetch_bybit_klines or the
+    2-D string array built by fetch_timeframe_data_chunked.
+    """
+    if len(klines_data) == 0:
         return pd.DataFrame()
     
     # Bybit format: [startTime, openPrice, highPrice, lowPrice, closePrice, volume, turnover]
-    rows = []
+    # All fields are strings; convert whole columns at once instead of row by row
+    data = np.asarray(klines_data)
+    timestamp_ms = data[:, 0].astype(np.int64)
     
-    for kline in klines_data:
-        timestamp_ms = int(kline[0])
-        timestamp_s = timestamp_ms // 1000  # Convert to seconds
-        
-        row = {
-            'Timestamp': timestamp_s,
-            'Open': float(kline[1]),
-            'High': float(kline[2]),
-            'Low': float(kline[3]),
-            'Close': float(kline[4]),
-            'Volume': float(kline[5]),
-            'Datetime': pd.to_datetime(timestamp_ms, unit='ms')
-        }
-        rows.append(row)
-    
-    df = pd.DataFrame(rows)
-    
-    # Remove timezone to avoid compatibility issues
-    df['Datetime'] = df['Datetime'].dt.tz_localize(None)
+    df = pd.DataFrame({
+        'Timestamp': timestamp_ms // 1000,  # Convert to seconds
+        'Open': data[:, 1].astype(np.float64),
+        'High': data[:, 2].astype(np.float64),
+        'Low': data[:, 3].astype(np.float64),
+        'Close': data[:, 4].astype(np.float64),
+        'Volume': data[:, 5].astype(np.float64),
+        # Reinterpret the milliseconds as naive UTC datetimes in one cast (widened
+        # to nanoseconds, the resolution pandas has always produced here)
+        'Datetime': timestamp_ms.view('datetime64[ms]').astype('datetime64[ns]')
+    })
     
     # Sort by timestamp (oldest first for chronological order)
-    df = df.sort_values('Timestamp').reset_index(drop=True)
+    df = df.sort_values('Timestamp', kind='stable', ignore_index=True)
     
     return df
 
 def save_to_csv(df, filename):
-    """Save DataFrame to CSV file"""
+    """
+    Save DataFrame to CSV file, plus a zstd Parquet copy next to it
+    
+    Both are written from one Arrow table with Arrow's multi-threaded C++
+    writers instead of pandas' row-by-row CSV formatter.
+    """
     if df.empty:
         print(f"No data to save for {filename}")
         return
     
     try:
-        df.to_csv(filename, index=False)
+        table = to_output_table(df)
+        write_csv(table, filename)
+        pq.write_table(table, f"{os.path.splitext(filename)[0]}.parquet", compression='zstd')
+        
         print(f"✅ Saved {len(df)} records to {filename}")
         print(f"📅 Date range: {df['Datetime'].min()} to {df['Datetime'].max()}")
         
         # Show file size
-        import os
         file_size_mb = os.path.getsize(filename) / (1024 * 1024)
         print(f"📁 File size: {file_size_mb:.2f} MB")
         
@@ -118,19 +154,13 @@ def save_to_csv(df, filename):
 def fetch_timeframe_data_chunked(symbol, interval, timeframe_name, start_time, end_time):
     """
     Fetch all data for a timeframe by chunking into manageable pieces
+    
+    Returns a 2-D array of kline fields (as strings), one row per kline
     """
-    print(f"\n📊 Fetching {timeframe_name} data for {symbol}")
-    print(f"   Interval: {interval}")
-    print(f"   Start: {datetime.fromtimestamp(start_time)}")
-    print(f"   End: {datetime.fromtimestamp(end_time)}")
-    
-    # Calculate appropriate chunk sizes for different timeframes
-    timeframe_minutes = {
-        '5': 5, '15': 15, '30': 30, '60': 60, 
-        '240': 240, '360': 360, '720': 720, 'D': 1440
-    }
+    logger.debug("📊 Fetching %s data for %s (interval %s) from %s to %s", timeframe_name, symbol,
+                 interval, datetime.fromtimestamp(start_time), datetime.fromtimestamp(end_time))
     
-    minutes_per_candle = timeframe_minutes.get(interval, 5)
+    minutes_per_candle = INTERVAL_MINUTES.get(interval, 5)
     
     # Determine chunk size based on timeframe
     if interval in ['5', '15']:
@@ -144,49 +174,144 @@ def fetch_timeframe_data_chunked(symbol, interval, timeframe_name, start_time, e
     
     chunk_size_seconds = chunk_hours * 3600
     
-    # Calculate total requests needed
-    total_seconds = end_time - start_time
-    estimated_requests = math.ceil(total_seconds / chunk_size_seconds)
-    
-    print(f"   📈 Chunk size: {chunk_hours} hours")
-    print(f"   🔢 Estimated requests: {estimated_requests}")
-    print("   " + "-" * 40)
-    
-    all_data = []
+    # Every window is known up front: each one starts one candle after the
+    # previous window's (inclusive) end
+    windows = []
     current_start = start_time
-    request_count = 0
-    
     while current_start < end_time:
-        request_count += 1
         chunk_end = min(current_start + chunk_size_seconds, end_time)
-        
-        start_str = datetime.fromtimestamp(current_start).strftime('%Y-%m-%d %H:%M')
-        end_str = datetime.fromtimestamp(chunk_end).strftime('%Y-%m-%d %H:%M')
-        
-        print(f"   📦 Request {request_count}/{estimated_requests}")
-        print(f"      Period: {start_str} to {end_str}")
-        print(f"      Duration: {(chunk_end - current_start) / 3600:.1f} hours")
-        
-        # Fetch chunk data
-        chunk_data = fetch_bybit_klines(symbol, interval, current_start, chunk_end, 1000)
-        
-        if chunk_data:
-            all_data.extend(chunk_data)
-            print(f"      📈 Total records so far: {len(all_data):,}")
-        
-        # Move to next chunk
+        windows.append((current_start, chunk_end))
         current_start = chunk_end + (minutes_per_candle * 60)
+    
+    # The window list is the exact request count
+    total_requests = len(windows)
+    
+    logger.debug("   📈 Chunk size: %d hours, %d requests", chunk_hours, total_requests)
+    
+    # Each chunk becomes one compact 2-D string array as it arrives instead of
+    # thousands of small Python lists; they are joined once at the end
+    parts = []
+    total_records = 0
+    
+    # Fetch several windows at once; the shared token bucket keeps the request
+    # rate under Bybit's limit instead of sleeping between requests
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+        # map() yields results in submission order, so chunks stay chronological
+        results = executor.map(
+            lambda window: fetch_bybit_klines(symbol, interval, window[0], window[1], 1000),
+            windows
+        )
         
-        # Rate limiting
-        if current_start < end_time:
-            print(f"      ⏱️  Waiting 2 seconds...")
-            time.sleep(2)
+        try:
+            for request_count, ((chunk_start, chunk_end), chunk_data) in enumerate(zip(windows, results), 1):
+                # Checked before using the chunk, which may be empty only
+                # because the download is stopping
+                if _STOP.is_set():
+                    raise RuntimeError(f"{timeframe_name}: stopped before request "
+                                       f"{request_count}/{total_requests}")
+                
+                if chunk_data:
+                    parts.append(np.asarray(chunk_data))
+                    total_records += len(chunk_data)
+                
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("   📦 %s request %d/%d: %s to %s, %d records so far", timeframe_name,
+                                 request_count, total_requests,
+                                 datetime.fromtimestamp(chunk_start).strftime('%Y-%m-%d %H:%M'),
+                                 datetime.fromtimestamp(chunk_end).strftime('%Y-%m-%d %H:%M'),
+                                 total_records)
+        finally:
+            # However the loop ends, drop the requests that have not started
+            executor.shutdown(wait=False, cancel_futures=True)
     
-    print(f"   ✅ {timeframe_name}: {len(all_data):,} total records collected")
-    return all_data
+    logger.info("   ✅ %s: %s records collected in %d requests", timeframe_name,
+                f"{total_records:,}", total_requests)
+    return np.concatenate(parts) if parts else np.empty((0, 7), dtype=str)
+
+def process_timeframe(symbol, config, i, total_timeframes, start_time, end_time):
+    """
+    Download, convert and save one timeframe; returns True if its file was written
+    """
+    interval = config['interval']
+    timeframe_name = config['name']
+    filename = config['filename']
+    
+    if _STOP.is_set():
+        return False
+    
+    print(f"\n🎯 Processing {i}/{total_timeframes}: {timeframe_name}")
+    print("="*50)
+    
+    try:
+        # Fetch data for this timeframe
+        all_klines = fetch_timeframe_data_chunked(symbol, interval, timeframe_name, start_time, end_time)
+        
+        if len(all_klines) > 0:
+            print(f"\n   📊 Converting {len(all_klines):,} records to DataFrame...")
+            
+            # Convert to DataFrame
+            df = klines_to_dataframe(all_klines)
+            
+            if not df.empty:
+                # Remove duplicates; klines_to_dataframe sorted stably by
+                # Timestamp, so repeats are adjacent and the first of each run
+                # is the first one fetched
+                initial_count = len(df)
+                timestamps = df['Timestamp'].to_numpy()
+                keep = np.empty(len(timestamps), dtype=bool)
+                keep[0] = True
+                keep[1:] = timestamps[1:] != timestamps[:-1]
+                df = df[keep]
+                final_count = len(df)
+                
+                if initial_count != final_count:
+                    print(f"   🧹 Removed {initial_count - final_count} duplicate records")
+                
+                # Save to CSV
+                print(f"\n   💾 Saving data...")
+                save_to_csv(df, filename)
+                
+                # Show summary (held together so other timeframes' output
+                # cannot interleave with it)
+                with _PRINT_LOCK:
+                    print(f"   📈 Summary for {timeframe_name}:")
+                    print(f"      Records: {len(df):,}")
+                    print(f"      Price range: ${df['Low'].min():.2f} - ${df['High'].max():.2f}")
+                    print(f"      Total volume: {df['Volume'].sum():,.2f}")
+                    
+                    # Show sample data
+                    print(f"   📋 Sample data (first 3 rows):")
+                    sample_cols = ['Datetime', 'Open', 'High', 'Low', 'Close', 'Volume']
+                    sample_df = df[sample_cols].head(3)
+                    for _, row in sample_df.iterrows():
+                        print(f"      {row['Datetime']} | O:{row['Open']:.2f} H:{row['High']:.2f} L:{row['Low']:.2f} C:{row['Close']:.2f} V:{row['Volume']:.2f}")
+                
+                return True
+                
+            else:
+                print(f"   ❌ No valid data after processing for {timeframe_name}")
+        else:
+            print(f"   ❌ No data collected for {timeframe_name}")
+            
+    except Exception as e:
+        if _STOP.is_set():
+            print(f"   ⏹️ Stopped {timeframe_name}")
+            return False
+        print(f"   ❌ Error processing {timeframe_name}: {e}")
+        import traceback
+        traceback.print_exc()
+    
+    return False
 
 def fetch_all_timeframes():
     """Fetch all requested timeframes for the full year"""
+    global _CACHE
+    
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    
+    if _CACHE is None:
+        _CACHE = KlineCache(CACHE_PATH)
+    
     symbol = "BTCUSDT"
     start_time = 1701388800  # Dec 1, 2023
     end_time = 1733011200    # Dec 1, 2024
@@ -214,73 +339,36 @@ def fetch_all_timeframes():
     print(f"📊 Timeframes: {len(timeframe_configs)}")
     print("="*70)
     
-    # Test API connection first
+    # Test API connection first; a cached answer would not prove anything
     print("🔍 Testing API connection...")
-    test_data = fetch_bybit_klines(symbol, '5', start_time, start_time + 3600, 5)
+    test_data = fetch_bybit_klines(symbol, '5', start_time, start_time + 3600, 5, use_cache=False)
     if not test_data:
         print("❌ API connection test failed! Check symbol and internet connection.")
         return
     print("✅ API connection successful!")
     
-    successful_downloads = 0
     total_timeframes = len(timeframe_configs)
     
-    for i, config in enumerate(timeframe_configs, 1):
-        interval = config['interval']
-        timeframe_name = config['name']
-        filename = config['filename']
-        
-        print(f"\n🎯 Processing {i}/{total_timeframes}: {timeframe_name}")
-        print("="*50)
-        
+    # Timeframes are independent, so download them all at once; the total time is
+    # then that of the largest timeframe rather than the sum of all of them
+    _STOP.clear()
+    with ThreadPoolExecutor(max_workers=TIMEFRAME_WORKERS) as executor:
         try:
-            # Fetch data for this timeframe
-            all_klines = fetch_timeframe_data_chunked(symbol, interval, timeframe_name, start_time, end_time)
-            
-            if all_klines:
-                print(f"\n   📊 Converting {len(all_klines):,} records to DataFrame...")
-                
-                # Convert to DataFrame
-                df = klines_to_dataframe(all_klines)
-                
-                if not df.empty:
-                    # Remove duplicates
-                    initial_count = len(df)
-                    df = df.drop_duplicates(subset=['Timestamp'], keep='first')
-                    final_count = len(df)
-                    
-                    if initial_count != final_count:
-                        print(f"   🧹 Removed {initial_count - final_count} duplicate records")
-                    
-                    # Save to CSV
-                    print(f"\n   💾 Saving data...")
-                    save_to_csv(df, filename)
-                    
-                    # Show summary
-                    print(f"   📈 Summary for {timeframe_name}:")
-                    print(f"      Records: {len(df):,}")
-                    print(f"      Price range: ${df['Low'].min():.2f} - ${df['High'].max():.2f}")
-                    print(f"      Total volume: {df['Volume'].sum():,.2f}")
-                    
-                    # Show sample data
-                    print(f"   📋 Sample data (first 3 rows):")
-                    sample_cols = ['Datetime', 'Open', 'High', 'Low', 'Close', 'Volume']
-                    sample_df = df[sample_cols].head(3)
-                    for _, row in sample_df.iterrows():
-                        print(f"      {row['Datetime']} | O:{row['Open']:.2f} H:{row['High']:.2f} L:{row['Low']:.2f} C:{row['Close']:.2f} V:{row['Volume']:.2f}")
-                    
-                    successful_downloads += 1
-                    
-                else:
-                    print(f"   ❌ No valid data after processing for {timeframe_name}")
-            else:
-                print(f"   ❌ No data collected for {timeframe_name}")
-                
-        except Exception as e:
-            print(f"   ❌ Error processing {timeframe_name}: {e}")
-            import traceback
-            traceback.print_exc()
-            continue
+            results = list(executor.map(
+                lambda numbered: process_timeframe(symbol, numbered[1], numbered[0], total_timeframes,
+                                                   start_time, end_time),
+                enumerate(timeframe_configs, 1)
+            ))
+        except KeyboardInterrupt:
+            # Only the main thread sees Ctrl+C: tell the workers to stop at their
+            # next request, drop timeframes that have not started, and let the
+            # running ones wind down before re-raising
+            print("\n⏹️ Stopping the timeframe downloads...")
+            _STOP.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+    
+    successful_downloads = sum(results)
     
     # Final summary
     print("\n" + "="*70)
@@ -294,7 +382,6 @@ def fetch_all_timeframes():
             filename = config['filename']
             if filename:  # Check if file was actually created
                 try:
-                    import os
                     if os.path.exists(filename):
                         file_size_mb = os.path.getsize(filename) / (1024 * 1024)
                         df = pd.read_csv(filename)
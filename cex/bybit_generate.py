@@ -1,23 +1,87 @@
+import numpy as np
 import pandas as pd
+import pyarrow.csv as pacsv
 import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
+
+from kline_csv import CSV_CONVERT_OPTIONS, to_output_table, volume_decimals, write_csv
+
+# Nanoseconds in a day
+DAY_NS = 86_400 * 1_000_000_000
+
+# Each timeframe is aggregated from this finer one instead of from the 1-minute
+# data (the source period divides the target period and shares its boundaries)
+SOURCE_TIMEFRAME = {
+    '5min': '1min',
+    '15min': '5min',
+    '30min': '15min',
+    '1h': '30min',
+    '4h': '1h',
+    '6h': '1h',
+    '12h': '4h',
+    '1d': '12h',
+    '1M': '1d'
+}
+
+# Timeframes whose candles are identical to another timeframe's; they reuse its
+# aggregation instead of resampling again
+TIMEFRAME_ALIASES = {
+    '1Y_monthly': '1M'
+}
+
+
+def bin_ohlcv(ohlcv: pd.DataFrame, bin_ns: int) -> pd.DataFrame:
+    """
+    Aggregate time-sorted OHLCV candles into fixed-width bins in one linear pass
+    
+    Bins start at multiples of bin_ns since the epoch, which for periods that
+    divide a day are the same bins resample() uses. Rows sharing a bin are
+    contiguous, so each column reduces with a single ufunc.reduceat call, and
+    bins without candles never appear.
+    
+    Args:
+        ohlcv: Non-empty OHLCV DataFrame with a sorted DatetimeIndex
+        bin_ns: Bin width in nanoseconds
+        
+    Returns:
+        Aggregated OHLCV DataFrame indexed by bin start
+    """
+    keys = ohlcv.index.asi8 // bin_ns
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    ends = np.append(starts[1:], len(keys)) - 1
+    
+    return pd.DataFrame({
+        'Open': ohlcv['Open'].to_numpy()[starts],
+        'High': np.maximum.reduceat(ohlcv['High'].to_numpy(), starts),
+        'Low': np.minimum.reduceat(ohlcv['Low'].to_numpy(), starts),
+        'Close': ohlcv['Close'].to_numpy()[ends],
+        'Volume': np.add.reduceat(ohlcv['Volume'].to_numpy(), starts)
+    }, index=pd.DatetimeIndex(keys[starts] * bin_ns, name='Datetime'))
+
+
+def write_output(df: pd.DataFrame, path: str, decimals: Optional[int]) -> None:
+    """Convert an output DataFrame and write it to CSV (runs on a writer thread)"""
+    write_csv(to_output_table(df, decimals), path)
+
 
 class BybitTimeframeResampler:
     def __init__(self):
         # Define timeframes and their pandas resample codes
         self.timeframes = {
-            '1min': '1T',
-            '5min': '5T', 
-            '15min': '15T',
-            '30min': '30T',
-            '1h': '1H',
-            '4h': '4H',
-            '6h': '6H', 
-            '12h': '12H',
+            '1min': '1min',
+            '5min': '5min', 
+            '15min': '15min',
+            '30min': '30min',
+            '1h': '1h',
+            '4h': '4h',
+            '6h': '6h', 
+            '12h': '12h',
             '1d': '1D',
-            '1M': '1M',      # 1 Month
-            '1Y_monthly': 'M'  # Yearly data as monthly aggregation (12 rows)
+            '1M': '1MS',      # 1 Month, labelled by its first day
+            '1Y_monthly': '1MS'  # Yearly data as monthly aggregation (12 rows)
         }
         
         # OHLCV aggregation rules
@@ -37,13 +101,18 @@ class BybitTimeframeResampler:
             filename: Path to the 1-minute CSV file
             
         Returns:
-            DataFrame with properly formatted data
+            DataFrame with properly formatted data; attrs['unmodified'] is True
+            when the file was already in output layout (column order, sorted,
+            no missing values), so it can stand in for the 1min output as is
         """
         print(f"📂 Loading 1-minute data from {filename}...")
         
         try:
-            # Read the CSV file
-            df = pd.read_csv(filename)
+            # Read the CSV file with Arrow's multi-threaded reader, which types every
+            # column (including Datetime) in the same pass
+            table = pacsv.read_csv(filename, convert_options=CSV_CONVERT_OPTIONS)
+            df = table.to_pandas(self_destruct=True)
+            del table
             
             # Validate required columns
             required_cols = ['Timestamp', 'Open', 'High', 'Low', 'Close', 'Volume', 'Datetime']
@@ -52,19 +121,15 @@ class BybitTimeframeResampler:
             if missing_cols:
                 raise ValueError(f"Missing required columns: {missing_cols}")
             
-            # Convert Datetime column to pandas datetime
-            df['Datetime'] = pd.to_datetime(df['Datetime'])
+            in_output_layout = list(df.columns) == required_cols
             
             # Set Datetime as index for resampling
             df.set_index('Datetime', inplace=True)
             
-            # Ensure numeric columns are properly typed
-            numeric_cols = ['Open', 'High', 'Low', 'Close', 'Volume']
-            for col in numeric_cols:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-            
             # Sort by datetime
-            df.sort_index(inplace=True)
+            was_sorted = df.index.is_monotonic_increasing
+            if not was_sorted:
+                df.sort_index(inplace=True)
             
             # Remove any rows with NaN values
             initial_count = len(df)
@@ -74,6 +139,8 @@ class BybitTimeframeResampler:
             if initial_count != final_count:
                 print(f"   🧹 Removed {initial_count - final_count} rows with missing data")
             
+            df.attrs['unmodified'] = in_output_layout and was_sorted and initial_count == final_count
+            
             print(f"✅ Loaded {len(df):,} records")
             print(f"📅 Date range: {df.index.min()} to {df.index.max()}")
             
@@ -83,52 +150,75 @@ class BybitTimeframeResampler:
             print(f"❌ Error loading data: {e}")
             raise
     
-    def resample_timeframe(self, df: pd.DataFrame, timeframe_code: str) -> pd.DataFrame:
+    def aggregate_ohlcv(self, ohlcv: pd.DataFrame, timeframe_code: str) -> pd.DataFrame:
         """
-        Resample data to specified timeframe
+        Aggregate OHLCV candles into a coarser timeframe
+        
+        First/max/min/last/sum give the same candles whether they run over the
+        1-minute data or over an intermediate timeframe (Volume sums may differ
+        in the last bit, as they are added in a different order; they are
+        rounded to the source precision when written).
         
         Args:
-            df: Original 1-minute DataFrame
-            timeframe_code: Pandas resample code (e.g., '5T', '1H')
+            ohlcv: OHLCV DataFrame indexed by Datetime, at 1 minute or any finer
+                timeframe that divides timeframe_code
+            timeframe_code: Pandas resample code (e.g., '5min', '1h')
             
         Returns:
-            Resampled DataFrame
+            Aggregated OHLCV DataFrame indexed by Datetime
         """
-        print(f"   🔄 Resampling to {timeframe_code}...")
+        # Fixed-width periods that divide a day reduce in one NumPy pass; calendar
+        # periods such as months go through pandas
+        offset = pd.tseries.frequencies.to_offset(timeframe_code)
+        if len(ohlcv) and isinstance(offset, pd.offsets.Tick) and DAY_NS % offset.nanos == 0:
+            return bin_ohlcv(ohlcv, offset.nanos)
         
         # Resample using OHLCV aggregation rules
-        resampled = df[['Open', 'High', 'Low', 'Close', 'Volume']].resample(timeframe_code).agg(self.agg_rules)
+        resampled = ohlcv[['Open', 'High', 'Low', 'Close', 'Volume']].resample(timeframe_code).agg(self.agg_rules)
         
         # Remove rows where no data exists (all NaN)
-        resampled = resampled.dropna()
+        return resampled.dropna()
+    
+    def format_output(self, ohlcv: pd.DataFrame) -> pd.DataFrame:
+        """
+        Turn a Datetime-indexed OHLCV DataFrame into the output column layout
         
+        Args:
+            ohlcv: Aggregated OHLCV DataFrame from aggregate_ohlcv
+            
+        Returns:
+            DataFrame with Timestamp, OHLCV and Datetime columns
+        """
         # Reset index to get Datetime as column
-        resampled.reset_index(inplace=True)
+        resampled = ohlcv.reset_index()
         
-        # Create Timestamp column (Unix timestamp in seconds)
-        resampled['Timestamp'] = (resampled['Datetime'].astype('int64') // 10**9).astype(int)
+        # Create Timestamp column (Unix timestamp in seconds) by reinterpreting the
+        # datetime64[ns] buffer as int64 instead of going through a pandas cast
+        resampled['Timestamp'] = resampled['Datetime'].values.view('int64') // 1_000_000_000
         
         # Reorder columns to match original format
-        resampled = resampled[['Timestamp', 'Open', 'High', 'Low', 'Close', 'Volume', 'Datetime']]
-        
-        print(f"   ✅ Created {len(resampled):,} {timeframe_code} candles")
-        
-        return resampled
+        return resampled[['Timestamp', 'Open', 'High', 'Low', 'Close', 'Volume', 'Datetime']]
     
-    def process_all_timeframes(self, input_file: str, output_dir: str = None) -> Dict[str, str]:
+    def process_all_timeframes(self, input_file: str, output_dir: str = None,
+                               compress: bool = False) -> Dict[str, Tuple[str, int, int]]:
         """
         Process all timeframes and save to separate CSV files
         
         Args:
-            input_file: Path to 1-minute CSV file
+            input_file: Path to 1-minute CSV file (may be gzip-compressed)
             output_dir: Directory to save output files (optional)
+            compress: Write gzip-compressed .csv.gz files instead of plain CSVs
             
         Returns:
-            Dictionary mapping timeframe to output filename
+            Dictionary mapping timeframe to (output filename, record count, file size
+            in bytes)
         """
         # Load the 1-minute data
         df_1min = self.load_data(input_file)
         
+        # Aggregated volumes are written at the precision of the 1-minute ones
+        decimals = volume_decimals(df_1min['Volume'].to_numpy())
+        
         # Set output directory
         if output_dir is None:
             output_dir = os.path.dirname(input_file) or '.'
@@ -137,7 +227,7 @@ class BybitTimeframeResampler:
         os.makedirs(output_dir, exist_ok=True)
         
         # Extract base filename without extension
-        base_name = os.path.splitext(os.path.basename(input_file))[0]
+        base_name = os.path.splitext(os.path.basename(input_file).removesuffix('.gz'))[0]
         # Remove existing timeframe designation if present
         base_name = base_name.replace('_1min', '').replace('_1m', '')
         
@@ -147,56 +237,106 @@ class BybitTimeframeResampler:
         print(f"💾 Output directory: {output_dir}")
         print("-" * 60)
         
-        for timeframe_name, timeframe_code in self.timeframes.items():
-            print(f"\n📊 Processing {timeframe_name}...")
+        # Aggregated frames (still indexed by Datetime) that coarser timeframes
+        # are built from, so only the 5-minute pass scans the 1-minute data
+        aggregated = {'1min': df_1min}
+        
+        # Files are written on worker threads while the next timeframe is
+        # aggregated; aggregation itself stays sequential because each timeframe
+        # is built from a finer one
+        writes = {}
+        with ThreadPoolExecutor(max_workers=min(len(self.timeframes), os.cpu_count() or 1)) as executor:
+            for timeframe_name, timeframe_code in self.timeframes.items():
+                try:
+                    # Generate output filename
+                    output_filename = f"{base_name}_{timeframe_name}.csv"
+                    if compress:
+                        output_filename += '.gz'
+                    output_path = os.path.join(output_dir, output_filename)
+                    
+                    if timeframe_name == '1min':
+                        candles = df_1min
+                        if df_1min.attrs.get('unmodified') and input_file.endswith('.gz') == compress:
+                            # The input already is the 1min output; copy the file
+                            # instead of formatting half a million rows again
+                            future = executor.submit(shutil.copyfile, input_file, output_path)
+                            messages = [f"   ✅ Copied original 1-minute data: {len(candles):,} records"]
+                        else:
+                            # Use original data but ensure proper format; its Timestamp
+                            # column was loaded with it, so there is nothing to derive.
+                            # Build the frame over the loaded arrays instead of copying
+                            # them through reset_index()
+                            resampled_df = pd.DataFrame({
+                                'Timestamp': df_1min['Timestamp'].to_numpy(),
+                                'Open': df_1min['Open'].to_numpy(),
+                                'High': df_1min['High'].to_numpy(),
+                                'Low': df_1min['Low'].to_numpy(),
+                                'Close': df_1min['Close'].to_numpy(),
+                                'Volume': df_1min['Volume'].to_numpy(),
+                                'Datetime': df_1min.index.to_numpy()
+                            }, copy=False)
+                            future = executor.submit(write_output, resampled_df, output_path, decimals)
+                            messages = [f"   ✅ Using original 1-minute data: {len(candles):,} records"]
+                    elif timeframe_name in TIMEFRAME_ALIASES:
+                        # Same candles as an already built timeframe
+                        target_name = TIMEFRAME_ALIASES[timeframe_name]
+                        candles = aggregated[timeframe_name] = aggregated[target_name]
+                        future = executor.submit(write_output, self.format_output(candles), output_path, decimals)
+                        messages = [f"   ✅ Reusing {target_name} candles: {len(candles):,} records"]
+                    else:
+                        source_name = SOURCE_TIMEFRAME[timeframe_name]
+                        candles = aggregated[timeframe_name] = self.aggregate_ohlcv(aggregated[source_name], timeframe_code)
+                        future = executor.submit(write_output, self.format_output(candles), output_path, decimals)
+                        messages = [f"   🔄 Resampled to {timeframe_code} from {source_name}",
+                                    f"   ✅ Created {len(candles):,} {timeframe_code} candles"]
+                    
+                    writes[timeframe_name] = (future, output_filename, output_path, candles, messages)
+                    
+                except Exception as e:
+                    writes[timeframe_name] = e
             
-            try:
-                # Resample data
-                if timeframe_name == '1min':
-                    # For 1min, just use original data but ensure proper format
-                    resampled_df = df_1min.copy()
-                    resampled_df.reset_index(inplace=True)
-                    resampled_df['Timestamp'] = (resampled_df['Datetime'].astype('int64') // 10**9).astype(int)
-                    resampled_df = resampled_df[['Timestamp', 'Open', 'High', 'Low', 'Close', 'Volume', 'Datetime']]
-                    print(f"   ✅ Using original 1-minute data: {len(resampled_df):,} records")
-                else:
-                    resampled_df = self.resample_timeframe(df_1min, timeframe_code)
-                
-                # Generate output filename
-                output_filename = f"{base_name}_{timeframe_name}.csv"
-                output_path = os.path.join(output_dir, output_filename)
-                
-                # Save to CSV
-                resampled_df.to_csv(output_path, index=False)
-                output_files[timeframe_name] = output_path
-                
-                # Show file info
-                file_size_mb = os.path.getsize(output_path) / (1024 * 1024)
-                print(f"   💾 Saved: {output_filename} ({file_size_mb:.2f} MB)")
+            # Report in timeframe order, waiting for each file as needed
+            for timeframe_name, timeframe_code in self.timeframes.items():
+                print(f"\n📊 Processing {timeframe_name}...")
                 
-                # Show date range
-                if len(resampled_df) > 0:
-                    print(f"   📅 Range: {resampled_df['Datetime'].min()} to {resampled_df['Datetime'].max()}")
-                
-                # Show sample data for verification
-                if len(resampled_df) >= 3:
-                    print(f"   📋 Sample (first 3 rows):")
-                    sample = resampled_df[['Datetime', 'Open', 'High', 'Low', 'Close', 'Volume']].head(3)
-                    for _, row in sample.iterrows():
-                        print(f"      {row['Datetime']} | O:{row['Open']:.2f} H:{row['High']:.2f} L:{row['Low']:.2f} C:{row['Close']:.2f} V:{row['Volume']:.2f}")
-                
-            except Exception as e:
-                print(f"   ❌ Error processing {timeframe_name}: {e}")
-                continue
+                try:
+                    if isinstance(writes[timeframe_name], Exception):
+                        raise writes[timeframe_name]
+                    future, output_filename, output_path, candles, messages = writes[timeframe_name]
+                    future.result()
+                    print('\n'.join(messages))
+                    
+                    # Stat the file once; the summary report reuses the size
+                    file_size = os.stat(output_path).st_size
+                    output_files[timeframe_name] = (output_path, len(candles), file_size)
+                    
+                    # Show file info
+                    file_size_mb = file_size / (1024 * 1024)
+                    print(f"   💾 Saved: {output_filename} ({file_size_mb:.2f} MB)")
+                    
+                    # Show date range
+                    if len(candles) > 0:
+                        print(f"   📅 Range: {candles.index.min()} to {candles.index.max()}")
+                    
+                    # Show sample data for verification
+                    if len(candles) >= 3:
+                        print(f"   📋 Sample (first 3 rows):")
+                        for dt, row in candles.head(3).iterrows():
+                            print(f"      {dt} | O:{row['Open']:.2f} H:{row['High']:.2f} L:{row['Low']:.2f} C:{row['Close']:.2f} V:{row['Volume']:.2f}")
+                    
+                except Exception as e:
+                    print(f"   ❌ Error processing {timeframe_name}: {e}")
+                    continue
         
         return output_files
     
-    def generate_summary_report(self, output_files: Dict[str, str]) -> None:
+    def generate_summary_report(self, output_files: Dict[str, Tuple[str, int, int]]) -> None:
         """
         Generate a summary report of all created files
         
         Args:
-            output_files: Dictionary of timeframe to filename mappings
+            output_files: Dictionary of timeframe to (filename, record count,
+                file size in bytes), as returned by process_all_timeframes
         """
         print("\n" + "="*70)
         print("📊 RESAMPLING SUMMARY REPORT")
@@ -209,16 +349,10 @@ class BybitTimeframeResampler:
         # Calculate data reduction ratios
         original_records = None
         
-        for timeframe, filepath in output_files.items():
+        for timeframe, (filepath, record_count, file_size) in output_files.items():
             try:
-                # Get file size
-                file_size = os.path.getsize(filepath)
                 size_mb = file_size / (1024 * 1024)
                 
-                # Count records
-                df = pd.read_csv(filepath)
-                record_count = len(df)
-                
                 # Calculate reduction ratio for reference
                 if timeframe == '1min':
                     original_records = record_count
@@ -242,7 +376,7 @@ class BybitTimeframeResampler:
         print(f"   • 1-day data: 1440x reduction (daily candles)")
         
         print(f"\n🎉 All timeframes generated successfully!")
-        print(f"📁 Files saved in: {os.path.dirname(list(output_files.values())[0])}")
+        print(f"📁 Files saved in: {os.path.dirname(list(output_files.values())[0][0])}")
 
 
 def main():
@@ -252,6 +386,7 @@ def main():
     # Configuration - Update this to match your 1-minute file
     INPUT_FILE = "bybit_BTCUSDT_1min_20231201_to_20241201.csv"  # Your 1-minute data file
     OUTPUT_DIR = "bybit_timeframes"  # Directory to save all timeframes
+    COMPRESS = False  # Write gzip-compressed .csv.gz files instead of plain CSVs
     
     print("🚀 Bybit Multi-Timeframe Resampler")
     print("   Converting 1-minute data to multiple timeframes")
@@ -269,7 +404,7 @@ def main():
         resampler = BybitTimeframeResampler()
         
         # Process all timeframes
-        output_files = resampler.process_all_timeframes(INPUT_FILE, OUTPUT_DIR)
+        output_files = resampler.process_all_timeframes(INPUT_FILE, OUTPUT_DIR, COMPRESS)
         
         # Generate summary report
         resampler.generate_summary_report(output_files)
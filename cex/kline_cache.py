@@ -0,0 +1,49 @@
+import json
+import sqlite3
+import threading
+from typing import List, Optional
+
+
+class KlineCache:
+    """
+    Thread-safe SQLite store of raw kline responses, keyed by request
+
+    Closed historical candles never change, so a chunk fetched once can be
+    served from disk on every later run instead of going back to the API.
+    Callers decide what is safe to store; the cache keeps entries forever.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS klines ('
+            'symbol TEXT, interval TEXT, start INTEGER, end INTEGER, lim INTEGER, data TEXT, '
+            'PRIMARY KEY (symbol, interval, start, end, lim))'
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def get(self, symbol: str, interval: str, start: int, end: int, limit: int) -> Optional[List]:
+        """
+        Look up a cached response
+
+        Returns:
+            The stored kline list, or None if the request has not been cached
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT data FROM klines WHERE symbol=? AND interval=? AND start=? AND end=? AND lim=?',
+                (symbol, interval, start, end, limit)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, symbol: str, interval: str, start: int, end: int, limit: int, data: List) -> None:
+        """Store the kline list returned for a request"""
+        payload = json.dumps(data, separators=(',', ':'))
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO klines VALUES (?, ?, ?, ?, ?, ?)',
+                (symbol, interval, start, end, limit, payload)
+            )
+            self._conn.commit()
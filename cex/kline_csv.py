@@ -0,0 +1,156 @@
+import gzip
+import io
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+
+# Column types for reading 1-minute CSVs (Datetime is optional in the input).
+# Prices stay float64: downcasting them to float32 made a year of 1-minute data
+# slower to process (1.62 s vs 1.06 s for Binance, 0.62 s vs 0.31 s for Bybit),
+# as the casts cost more than the smaller columns save
+CSV_CONVERT_OPTIONS = pacsv.ConvertOptions(column_types={
+    'Timestamp': pa.int64(),
+    'Open': pa.float64(),
+    'High': pa.float64(),
+    'Low': pa.float64(),
+    'Close': pa.float64(),
+    'Volume': pa.float64(),
+    'Datetime': pa.timestamp('ns')
+})
+
+# Write buffer for each output CSV
+OUTPUT_BUFFER_SIZE = 1 << 20
+
+# Most decimal places looked for in source volumes
+MAX_VOLUME_DECIMALS = 8
+
+
+def volume_decimals(volume: np.ndarray) -> Optional[int]:
+    """
+    Fewest decimal places that represent every source volume exactly
+
+    A sum of these volumes has no more decimal places than its terms, so
+    rounding aggregated volumes to this many places removes the noise float
+    addition leaves in the last bits (9954.731189999999 -> 9954.73119).
+
+    Args:
+        volume: 1-minute Volume column
+
+    Returns:
+        Number of decimal places, or None if some volume needs more than
+        MAX_VOLUME_DECIMALS
+    """
+    for decimals in range(MAX_VOLUME_DECIMALS + 1):
+        if np.array_equal(np.round(volume, decimals), volume):
+            return decimals
+    return None
+
+
+def to_output_table(df: pd.DataFrame, volume_decimals: Optional[int] = None) -> pa.Table:
+    """
+    Convert an output DataFrame to the Arrow table written to CSV (and Parquet)
+
+    Args:
+        df: DataFrame with Timestamp, OHLCV and Datetime columns
+        volume_decimals: Decimal places of the source volumes (see
+            volume_decimals()); Volume is rounded to them when given
+
+    Returns:
+        Arrow table with Datetime at second resolution
+    """
+    table = pa.Table.from_pandas(df, preserve_index=False)
+
+    if volume_decimals is not None:
+        # np.round divides by the power of ten, which lands on the nearest double
+        # (Arrow's round multiplies by its reciprocal and can leave noise behind)
+        volume = np.round(table['Volume'].to_numpy(), volume_decimals)
+        table = table.set_column(table.schema.get_field_index('Volume'), 'Volume', pa.array(volume))
+
+    # Second resolution renders '2024-01-01 00:00:00' instead of nanosecond digits.
+    # Arrow's writer formats timestamps natively, which is faster than passing a
+    # column pre-formatted with np.datetime_as_string
+    datetime_index = table.schema.get_field_index('Datetime')
+    return table.set_column(datetime_index, 'Datetime', table['Datetime'].cast(pa.timestamp('s')))
+
+
+def _float_text(column: pa.ChunkedArray) -> pa.Array:
+    """
+    Render a float column as Python's repr does, which is what pandas writes
+
+    Arrow's formatting only differs on whole numbers (no '.0'), on the
+    exponent threshold and on values below 1e-4, so just those values go
+    through repr; every one of them lacks a '.', has an 'e', or is that small.
+    """
+    column = column.combine_chunks()
+    text = column.cast(pa.string())
+    differs = pc.or_(pc.or_(pc.invert(pc.match_substring(text, '.')), pc.match_substring(text, 'e')),
+                     pc.and_(pc.less(pc.abs(column), 1e-4), pc.not_equal(column, 0)))
+    if not pc.any(differs).as_py():
+        return text
+    fixed = [repr(value) for value in pc.filter(column, differs).to_pylist()]
+    return pc.replace_with_mask(text, differs, pa.array(fixed, pa.string()))
+
+
+def to_csv_text(table: pa.Table, date_only: Optional[bool] = None) -> pa.Table:
+    """
+    Render an output table's columns as the text pandas' to_csv would write
+
+    Floats keep Python's repr ('42284.0', '1e-05'), and Datetime drops its
+    time part when every row is at midnight, as binance_client.save_to_csv
+    does. The typed table is what gets written to Parquet.
+
+    Args:
+        table: Table from to_output_table (or a batch of one as a table)
+        date_only: Write Datetime as dates only; by default, when every row is
+            at midnight. Pass False when the table is one piece of a larger file
+
+    Returns:
+        Table with the same columns, floats as strings
+    """
+    for index, field in enumerate(table.schema):
+        if pa.types.is_floating(field.type):
+            table = table.set_column(index, field.name, _float_text(table[field.name]))
+
+    datetime_index = table.schema.get_field_index('Datetime')
+    if date_only is None:
+        date_only = not (table['Timestamp'].to_numpy() % 86400).any()
+    if date_only:
+        table = table.set_column(datetime_index, 'Datetime', table['Datetime'].cast(pa.date32()))
+    return table
+
+
+def open_csv_output(path: str):
+    """
+    Open an output CSV for binary writing behind a 1 MiB buffer
+
+    Paths ending in .gz are gzip-compressed at level 1, which gets most of the
+    size reduction at a fraction of the default level's cost.
+    """
+    if path.endswith('.gz'):
+        return io.BufferedWriter(gzip.open(path, 'wb', compresslevel=1), buffer_size=OUTPUT_BUFFER_SIZE)
+    return open(path, 'wb', buffering=OUTPUT_BUFFER_SIZE)
+
+
+def write_csv(table: pa.Table, path: str) -> None:
+    """
+    Write an output table to CSV with Arrow's multi-threaded C++ writer
+
+    Arrow releases the GIL while formatting, as does gzip while compressing, so
+    several files can be written from threads at once. The text is the same as
+    pandas' to_csv would write (see to_csv_text).
+
+    Args:
+        table: Table from to_output_table
+        path: Output CSV path (gzip-compressed if it ends in .gz)
+    """
+    table = to_csv_text(table)
+
+    # Arrow quotes header names, so write the plain header line ourselves
+    with open_csv_output(path) as f:
+        f.write((','.join(table.column_names) + '\n').encode())
+        pacsv.write_csv(table, f, write_options=pacsv.WriteOptions(include_header=False,
+                                                                   quoting_style='none'))
@@ -0,0 +1,53 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket for pacing API requests
+
+    Tokens refill continuously at `refill_per_sec` up to `capacity`. Each
+    request takes tokens equal to its weight and blocks only when the bucket
+    is empty, so bursts go out immediately and sustained load is held to
+    the refill rate.
+    """
+
+    def __init__(self, capacity: float, refill_per_sec: float):
+        self.capacity = capacity
+        self.refill_per_sec = refill_per_sec
+        self.tokens = capacity
+        self.last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.refill_per_sec)
+        self.last_refill = now
+
+    def acquire(self, weight: float = 1) -> None:
+        """
+        Block until `weight` tokens are available, then consume them
+
+        Args:
+            weight: Number of tokens the request costs
+        """
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= weight:
+                    self.tokens -= weight
+                    return
+                wait = (weight - self.tokens) / self.refill_per_sec
+            time.sleep(wait)
+
+    def limit_to(self, available: float) -> None:
+        """
+        Cap the tokens currently available, e.g. to match a usage counter
+        reported by the server
+
+        Args:
+            available: Maximum tokens left in the bucket (may be negative)
+        """
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.tokens, available)